@@ -0,0 +1,506 @@
+#!/usr/bin/python
+
+import sys, getopt
+import sqlite3
+import json
+import io
+import os
+import platform
+import random
+import tempfile
+import time
+import tracemalloc
+
+import threading
+import http.server
+from xml.sax.saxutils import escape
+
+import goglinks
+
+# The query load_games used before GamePieces was pivoted in a single scan.
+# Kept here to measure the new query against it.
+LEGACY_GAMES_QUERY = '''
+SELECT
+     u.userId, u.isHidden, r.*
+    ,p.id AS platformId
+    ,IFNULL(p.name, "gog") AS platform
+    ,gpt.value as title
+    ,gps.value as summary
+    ,gpm.value as meta
+    ,gpmd.value as media
+    ,gpi.value as images
+    ,gpo.value AS sort
+    ,CASE
+        WHEN prk.externalId IS NULL AND ig.productId IS NULL THEN 0
+        WHEN prk.externalId IS NOT NULL AND ie.id IS NULL THEN 0
+        ELSE 1
+    END AS Installed
+FROM UserReleaseProperties AS u
+    LEFT JOIN ReleaseProperties AS r ON u.releaseKey = r.releaseKey
+    LEFT JOIN ProductsToReleaseKeys AS prk ON r.releaseKey = prk.releaseKey
+    LEFT JOIN Platforms AS p ON INSTR(r.releaseKey, p.name) > 0
+    LEFT JOIN GamePieces AS gpt ON r.releaseKey = gpt.releaseKey
+        INNER JOIN GamePieceTypes gtypes1 ON gpt.gamePieceTypeId = gtypes1.Id AND gtypes1.type = 'title'
+    LEFT JOIN GamePieces AS gps ON r.releaseKey = gps.releaseKey
+        INNER JOIN GamePieceTypes gtypes2 ON gps.gamePieceTypeId = gtypes2.Id AND gtypes2.type = 'summary'
+    LEFT JOIN GamePieces AS gpm  ON r.releaseKey = gpm.releaseKey
+        INNER JOIN GamePieceTypes gtypes3 ON gpm.gamePieceTypeId = gtypes3.Id AND gtypes3.type = 'meta'
+    LEFT JOIN GamePieces AS gpmd ON r.releaseKey = gpmd.releaseKey
+        INNER JOIN GamePieceTypes gtypes4 ON gpmd.gamePieceTypeId = gtypes4.Id AND gtypes4.type = 'media'
+    LEFT JOIN GamePieces AS gpi  ON r.releaseKey = gpi.releaseKey
+        INNER JOIN GamePieceTypes gtypes5 ON gpi.gamePieceTypeId = gtypes5.Id AND gtypes5.type = 'originalImages'
+    LEFT JOIN GamePieces AS gpo  ON r.releaseKey = gpo.releaseKey
+        INNER JOIN GamePieceTypes gtypes6 ON gpo.gamePieceTypeId = gtypes6.Id AND gtypes6.type = 'sortingTitle'
+    LEFT JOIN InstalledBaseProducts AS ig ON ig.productId = prk.gogId
+    LEFT JOIN InstalledExternalProducts AS ie ON ie.id = prk.externalId
+WHERE isVisibleInLibrary = 1 AND isDlc = 0 AND u.isHidden = 0
+'''
+
+PLATFORMS = ['steam', 'uplay', 'origin', 'epic', 'battlenet', 'xboxone', 'psn', 'humble',
+    'itch', 'amazon', 'bethesda', 'rockstar', 'generic', 'twitch', 'paradox', 'wargaming']
+
+PIECE_TYPES = ['title', 'summary', 'meta', 'media', 'originalImages', 'sortingTitle',
+    'myRating', 'osCompatibility', 'allGameReleases', 'reviewScore']
+
+ROMANS = ['', '', '', ' II', ' III', ' IV', ' 2', ' 3']
+
+def main(argv):
+
+    releases = 10000
+    platforms = len(PLATFORMS)
+    seed = 42
+    image_games = 200
+    image_size = 64 * 1024
+    latency = 20
+    workers = goglinks.DEFAULT_WORKERS
+    output_file = None
+
+    example = 'benchmark.py [-r <releases>] [-p <platforms>] [-i <games with images>] [-s <image bytes>] ' + \
+        '[-l <latency ms>] [-w <workers>] [-o <results.json>]'
+
+    try:
+        opts, args = getopt.getopt(argv,"hr:p:i:s:l:w:o:", \
+            ["releases=", "platforms=", "images=", "image-size=", "latency=", "workers=", "output="])
+    except getopt.GetoptError:
+        print(example)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            print(example)
+            sys.exit()
+
+        if opt in ("-r", "--releases"):
+            releases = int(arg)
+        if opt in ("-p", "--platforms"):
+            platforms = int(arg)
+        if opt in ("-i", "--images"):
+            image_games = int(arg)
+        if opt in ("-s", "--image-size"):
+            image_size = int(arg)
+        if opt in ("-l", "--latency"):
+            latency = int(arg)
+        if opt in ("-w", "--workers"):
+            workers = int(arg)
+        if opt in ("-o", "--output"):
+            output_file = arg
+
+    results = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'json_backend': goglinks.json_loads.__module__,
+        'parameters': {
+            'releases': releases, 'platforms': platforms, 'seed': seed, 'image_games': image_games,
+            'image_size': image_size, 'latency_ms': latency, 'workers': workers
+        },
+        'stages': {}
+    }
+    stages = results['stages']
+
+    server = ImageServer(image_size, latency / 1000.0)
+    try:
+        with tempfile.TemporaryDirectory() as work_folder:
+            gog_folder = os.path.join(work_folder, 'gog')
+            nvidia_folder = os.path.join(work_folder, 'nvidia')
+            shield_folder = os.path.join(work_folder, 'shield')
+            output_folder = os.path.join(work_folder, 'ael')
+            kodi_folder = os.path.join(work_folder, 'kodi')
+            os.makedirs(gog_folder)
+            os.makedirs(shield_folder)
+
+            db_path = os.path.join(gog_folder, 'galaxy-2.0.db')
+            create_synthetic_db(db_path, releases, platforms, seed, server.url)
+
+            legacy_time, legacy_rows = time_query(db_path, LEGACY_GAMES_QUERY)
+            stages['query_legacy'] = { 'seconds': legacy_time, 'rows': legacy_rows }
+            pivot_time, pivot_rows = time_query(db_path, goglinks.GAMES_QUERY)
+            stages['query'] = { 'seconds': pivot_time, 'rows': pivot_rows }
+
+            for name, access in (('decode_file_title', lambda game: game.fileTitle), ('decode_all_fields', read_all_fields)):
+                elapsed, memory, rows = time_decode(db_path, access)
+                stages[name] = { 'seconds': elapsed, 'memory_bytes': memory, 'rows': rows }
+
+            for name, snapshot in (('read_with_writer_live', False), ('read_with_writer_snapshot', True)):
+                stages[name] = time_concurrent_writer(gog_folder, snapshot)
+
+            games, stages['load_games'] = timed(goglinks.load_games, gog_folder)
+            stages['load_games']['games'] = len(games)
+
+            create_journal(os.path.join(nvidia_folder, 'journalBS.main.xml'), games, seed)
+
+            _, stages['create_nfos'] = timed(goglinks.create_nfos, games, output_folder, True)
+            stages['create_nfos']['games'] = len(games)
+            for fmt in sorted(goglinks.EXPORT_FILES):
+                name = 'export_catalog_{}'.format(fmt)
+                _, stages[name] = timed(goglinks.export_catalog, games, output_folder, [fmt])
+                stages[name]['games'] = len(games)
+
+            image_subset = games[:image_games]
+            for name, folder, style in (('download_images_ael', output_folder, 'AEL'), ('download_images_kodi', kodi_folder, 'KODI')):
+                requests = server.requests
+                downloads, stages[name] = timed(goglinks.download_images, image_subset, folder, True, style, workers)
+                stages[name].update(download_counts(downloads))
+                stages[name]['games'] = len(image_subset)
+                stages[name]['requests'] = server.requests - requests
+
+            # A cold download into the image cache, then a second run refreshing every image,
+            # which only revalidates them.
+            for name in ('download_images_cached', 'refresh_images_cached'):
+                store = goglinks.ImageStore(os.path.join(work_folder, 'cache'), goglinks.DEFAULT_CACHE_SIZE * 1024 * 1024)
+                requests, sent = server.requests, server.bytes
+                downloads, stages[name] = timed(goglinks.download_images, image_subset, kodi_folder, True, 'KODI', workers, store)
+                store.close()
+                stages[name].update(download_counts(downloads))
+                stages[name].update({ 'hits': store.hits, 'misses': store.misses, 'revalidated': store.revalidated })
+                stages[name]['requests'] = server.requests - requests
+                stages[name]['bytes'] = server.bytes - sent
+
+            # The same download against a CDN that throttles beyond two requests in flight.
+            server.max_concurrent = 2
+            requests, throttled = server.requests, server.throttled
+            goglinks.rate_control.reset(workers)
+            downloads, stages['download_images_throttled'] = timed(goglinks.download_images, image_subset,
+                os.path.join(work_folder, 'throttled'), True, 'KODI', workers)
+            server.max_concurrent = None
+            stages['download_images_throttled'].update(download_counts(downloads))
+            stages['download_images_throttled'].update({ 'requests': server.requests - requests,
+                'throttled': server.throttled - throttled,
+                'final_limit': min(int(host.limit) for host in goglinks.rate_control.hosts.values()) })
+
+            # The Kodi download with a one second time budget, which downloads the covers first.
+            goglinks.time_budget.reset(1.0)
+            downloads, stages['download_images_budget'] = timed(goglinks.download_images, image_subset,
+                os.path.join(work_folder, 'budget'), True, 'KODI', workers)
+            goglinks.time_budget.reset()
+            stages['download_images_budget'].update(download_counts(downloads))
+            stages['download_images_budget']['covers'] = sum(1 for result in downloads
+                if result.kind == 'cover' and result.status == 'ok')
+
+            _, stages['create_lnks'] = timed(goglinks.create_lnks, games, output_folder, True)
+            stages['create_lnks']['games'] = len(games)
+
+            recognized_games, stages['load_games_from_geforce'] = timed(goglinks.load_games_from_geforce, nvidia_folder)
+            stages['load_games_from_geforce']['recognized'] = len(recognized_games)
+            _, stages['add_games_to_shield'] = timed(goglinks.add_games_to_shield,
+                image_subset, recognized_games, output_folder, shield_folder, True)
+            stages['add_games_to_shield']['games'] = len(image_subset)
+            stages['add_games_to_shield']['matches'] = dict(recognized_games.matches)
+
+            # Every stage for the games with images, one stage after the other and as a task graph.
+            _, stages['stages_sequential'] = timed(run_sequential, image_subset, os.path.join(work_folder, 'sequential'),
+                nvidia_folder, os.path.join(work_folder, 'shield_sequential'), workers)
+            _, stages['stages_scheduled'] = timed(goglinks.run_stages, image_subset, os.path.join(work_folder, 'scheduled'),
+                True, True, True, True, True, 'AEL', workers, goglinks.GALAXY_CLIENT_PATH, None, None,
+                os.path.join(work_folder, 'shield_scheduled'))
+            for name in ('stages_sequential', 'stages_scheduled'):
+                stages[name]['games'] = len(image_subset)
+    finally:
+        server.close()
+
+    print_results(results)
+    if output_file is not None:
+        with open(output_file, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+def run_sequential(games, output_folder, nvidia_folder, shield_folder, workers):
+    # The stages as main ran them before the task graph.
+    goglinks.create_nfos(games, output_folder, True, workers)
+    goglinks.download_images(games, output_folder, True, 'AEL', workers)
+    goglinks.create_lnks(games, output_folder, True)
+    goglinks.add_games_to_shield(games, goglinks.load_games_from_geforce(nvidia_folder), output_folder, shield_folder, True)
+
+def timed(func, *args):
+    start = time.perf_counter()
+    value = func(*args)
+    return value, { 'seconds': time.perf_counter() - start }
+
+def download_counts(results):
+    counts = { 'ok': 0, 'skipped': 0, 'failed': 0, 'deferred': 0 }
+    for result in results:
+        counts[result.status] += 1
+    return counts
+
+def print_results(results):
+    parameters = results['parameters']
+    stages = results['stages']
+    print('Synthetic library: {} releases, {} platforms, images for {} games, {} ms latency, {} workers'.format(
+        parameters['releases'], parameters['platforms'], parameters['image_games'], parameters['latency_ms'], parameters['workers']))
+    for name, stage in stages.items():
+        details = ', '.join('{}={}'.format(key, value) for key, value in sorted(stage.items()) if key != 'seconds')
+        print('  {:24} {:9.3f}s  {}'.format(name, stage['seconds'], details))
+
+def time_query(db_path, query):
+    conn = sqlite3.connect(db_path)
+    start = time.perf_counter()
+    rows = len(conn.execute(query).fetchall())
+    elapsed = time.perf_counter() - start
+    conn.close()
+    return elapsed, rows
+
+def time_decode(db_path, access):
+    """Decodes every row into a Game and reads the fields access reads.
+    Returns the elapsed time, the memory still held by the games and the row count.
+    """
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = goglinks.dict_factory
+    rows = conn.execute(goglinks.GAMES_QUERY).fetchall()
+
+    start = time.perf_counter()
+    for row in rows:
+        access(goglinks.Game(row))
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    games = []
+    for row in conn.execute(goglinks.GAMES_QUERY):
+        game = goglinks.Game(row)
+        access(game)
+        games.append(game)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    conn.close()
+    return elapsed, memory, len(games)
+
+def time_concurrent_writer(gog_folder, snapshot, timeout = 0.25):
+    """Renders the NFO of every game in memory, as the stream mode would, while another
+    connection keeps committing small writes like GalaxyClient does during a sync.
+    Returns the elapsed time, the longest a commit waited for the lock and the number
+    of commits that gave up with "database is locked" after timeout seconds.
+    """
+    db_path = os.path.join(gog_folder, 'galaxy-2.0.db')
+    stop = threading.Event()
+    waits = []
+    locked = []
+
+    def writer():
+        conn = sqlite3.connect(db_path, timeout = timeout)
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                conn.execute('UPDATE ReleaseProperties SET isDlc = isDlc WHERE rowid = 1')
+                conn.commit()
+            except sqlite3.OperationalError:
+                conn.rollback()
+                locked.append(1)
+            waits.append(time.perf_counter() - start)
+            time.sleep(0.002)
+        conn.close()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    start = time.perf_counter()
+    try:
+        games = 0
+        for game in goglinks.iter_games(gog_folder, snapshot):
+            goglinks.write_nfo(game, io.StringIO())
+            games += 1
+    finally:
+        elapsed = time.perf_counter() - start
+        stop.set()
+        thread.join()
+    return { 'seconds': elapsed, 'games': games, 'commits': len(waits), 'locked': len(locked),
+        'max_commit_wait': round(max(waits) if waits else 0, 4) }
+
+def read_all_fields(game):
+    return (game.title, game.fileTitle, game.sortTitle, game.summary, game.score, game.genres,
+        game.developers, game.themes, game.releaseDate, game.platform, game.is_installed,
+        game.fanart, game.cover, game.icon, game.snaps, [video.get_url() for video in game.videos])
+
+def create_synthetic_db(db_path, releases, platforms = len(PLATFORMS), seed = 42, image_host = 'https://images.gog-statics.com'):
+    """Creates a galaxy-2.0.db with the tables load_games reads, filled with
+    the given number of releases spread over GOG and the integrated platforms.
+    Image URLs point at image_host.
+    """
+    rnd = random.Random(seed)
+    platform_names = PLATFORMS[:platforms]
+
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    c.executescript('''
+        CREATE TABLE UserReleaseProperties (releaseKey TEXT, userId INTEGER, isHidden INTEGER);
+        CREATE TABLE ReleaseProperties (releaseKey TEXT PRIMARY KEY, isDlc INTEGER, isVisibleInLibrary INTEGER, gameId TEXT);
+        CREATE TABLE ProductsToReleaseKeys (releaseKey TEXT, gogId INTEGER, externalId INTEGER);
+        CREATE TABLE Platforms (id INTEGER PRIMARY KEY, name TEXT);
+        CREATE TABLE GamePieceTypes (id INTEGER PRIMARY KEY, type TEXT);
+        CREATE TABLE GamePieces (releaseKey TEXT, gamePieceTypeId INTEGER, userId INTEGER, value TEXT);
+        CREATE UNIQUE INDEX GamePiecesIndex ON GamePieces (releaseKey, gamePieceTypeId, userId);
+        CREATE TABLE InstalledBaseProducts (productId INTEGER, installationPath TEXT);
+        CREATE TABLE InstalledExternalProducts (id INTEGER, platformId INTEGER, productId TEXT);
+    ''')
+
+    c.executemany('INSERT INTO Platforms (id, name) VALUES (?, ?)',
+        [(idx + 1, name) for idx, name in enumerate(platform_names)])
+    c.executemany('INSERT INTO GamePieceTypes (id, type) VALUES (?, ?)',
+        [(idx + 1, name) for idx, name in enumerate(PIECE_TYPES)])
+    type_ids = { name: idx + 1 for idx, name in enumerate(PIECE_TYPES) }
+
+    user_id = 1
+    for idx in range(releases):
+        platform = 'gog' if idx % 3 == 0 or not platform_names else rnd.choice(platform_names)
+        release_key = '{}_{}'.format(platform, 1000000 + idx)
+        is_dlc = 1 if rnd.random() < 0.1 else 0
+        title = 'Synthetic Game {}{}'.format(idx, rnd.choice(ROMANS))
+
+        c.execute('INSERT INTO UserReleaseProperties VALUES (?, ?, ?)', (release_key, user_id, 0))
+        c.execute('INSERT INTO ReleaseProperties VALUES (?, ?, ?, ?)', (release_key, is_dlc, 1, str(idx)))
+
+        if platform == 'gog':
+            c.execute('INSERT INTO ProductsToReleaseKeys VALUES (?, ?, NULL)', (release_key, idx))
+            if rnd.random() < 0.2:
+                c.execute('INSERT INTO InstalledBaseProducts VALUES (?, ?)', (idx, 'C:\\Games\\{}'.format(idx)))
+        else:
+            c.execute('INSERT INTO ProductsToReleaseKeys VALUES (?, NULL, ?)', (release_key, idx))
+            if rnd.random() < 0.2:
+                c.execute('INSERT INTO InstalledExternalProducts VALUES (?, ?, ?)', (idx, 1, str(idx)))
+
+        pieces = synthetic_game_pieces(rnd, idx, title, image_host)
+        for piece_type in PIECE_TYPES:
+            value = pieces.get(piece_type, json.dumps({ piece_type: None }))
+            c.execute('INSERT INTO GamePieces VALUES (?, ?, ?, ?)', (release_key, type_ids[piece_type], user_id, value))
+
+    conn.commit()
+    conn.close()
+
+def synthetic_game_pieces(rnd, idx, title, image_host):
+    # GOG stores the URLs with escaped slashes
+    image_base = '{}/{}'.format(image_host, idx).replace('/', '\\/')
+    return {
+        'title': json.dumps({ 'title': title }),
+        'sortingTitle': json.dumps({ 'title': title.lower() }),
+        'summary': json.dumps({ 'summary': 'Summary of {}.\n{}'.format(title, 'Lorem ipsum dolor sit amet. ' * rnd.randint(5, 40)) }),
+        'meta': json.dumps({
+            'criticsScore': rnd.randint(10, 99) if rnd.random() < 0.8 else None,
+            'developers': ['Developer {}'.format(rnd.randint(1, 500))],
+            'publishers': ['Publisher {}'.format(rnd.randint(1, 200))],
+            'genres': rnd.sample(['Action', 'Adventure', 'RPG', 'Strategy', 'Shooter', 'Puzzle', 'Racing'], 2),
+            'themes': rnd.sample(['Fantasy', 'Sci-fi', 'Horror', 'Comedy', 'Historical'], 1),
+            'releaseDate': rnd.randint(631152000, 1600000000)
+        }),
+        'media': json.dumps({
+            'screenshots': ['{}_s{}{{formatter}}.{{ext}}'.format(image_base, n) for n in range(rnd.randint(0, 8))],
+            'videos': [{ 'name': 'Trailer', 'provider': 'youtube', 'videoId': 'vid{}'.format(idx) }] if rnd.random() < 0.7 else []
+        }),
+        'originalImages': json.dumps({
+            'background': '{}_bg.webp'.format(image_base),
+            'squareIcon': '{}_icon.webp'.format(image_base),
+            'verticalCover': '{}_cover.webp'.format(image_base)
+        })
+    }
+
+def create_journal(journal_path, games, seed = 42):
+    """Writes a GeForce Experience journalBS.main.xml that recognizes part of the
+    games, some of them with the roman numerals in their title written as numbers.
+    """
+    rnd = random.Random(seed)
+    os.makedirs(os.path.dirname(journal_path), exist_ok=True)
+    with open(journal_path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n<Journal>\n  <Application>\n')
+        for idx, game in enumerate(games):
+            if rnd.random() > 0.3:
+                continue
+            title = game.sortTitle
+            if rnd.random() < 0.5:
+                title = goglinks.convert_romans_in_text(title.upper())
+            f.write('    <Game_{0}>\n      <DisplayName>{1}</DisplayName>\n      <ShortName>{2}</ShortName>\n'
+                '      <IsStreamingSupported>{3}</IsStreamingSupported>\n    </Game_{0}>\n'.format(
+                idx, escape(game.title), escape(title.replace(' ', '_')), 1 if rnd.random() < 0.9 else 0))
+        f.write('  </Application>\n</Journal>\n')
+
+class ImageServer(object):
+    """Local HTTP server with keep-alive that answers every GET with an image of
+    image_size bytes after waiting latency seconds, standing in for the GOG CDN.
+    Like the CDN it sends an ETag and answers 304 to a matching If-None-Match.
+    Requests beyond max_concurrent in flight are throttled with a 429, sent without
+    Retry-After (unless retry_after is set) so the client has to back off by itself.
+    """
+
+    def __init__(self, image_size, latency, max_concurrent = None, retry_after = None):
+        self.retry_after = retry_after
+        self.requests = 0
+        self.bytes = 0
+        self.throttled = 0
+        self.active = 0
+        self.max_concurrent = max_concurrent
+        body = bytes(range(256)) * (image_size // 256 + 1)
+        body = body[:image_size]
+        etag = '"{:x}"'.format(image_size)
+        lock = threading.Lock()
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                with lock:
+                    server.requests += 1
+                    throttled = server.max_concurrent is not None and server.active >= server.max_concurrent
+                    if throttled:
+                        server.throttled += 1
+                    else:
+                        server.active += 1
+                if throttled:
+                    self.send_response(429)
+                    if server.retry_after is not None:
+                        self.send_header('Retry-After', str(server.retry_after))
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                try:
+                    self.send_image()
+                finally:
+                    with lock:
+                        server.active -= 1
+
+            def send_image(self):
+                if latency > 0:
+                    time.sleep(latency)
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/png')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(body)
+                with lock:
+                    server.bytes += len(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._httpd.daemon_threads = True
+        self.url = 'http://127.0.0.1:{}'.format(self._httpd.server_port)
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,75 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import benchmark
+import goglinks
+
+class TimeBudgetTest(unittest.TestCase):
+    """Once the time budget is used up only requests are deferred, images in the
+    cache are still placed, and the deferred images are fetched by the next pass.
+    """
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        benchmark.create_synthetic_db(os.path.join(self.folder.name, 'galaxy-2.0.db'), 10)
+        self.output_folder = os.path.join(self.folder.name, 'out')
+        self.store = goglinks.ImageStore(os.path.join(self.folder.name, 'cache'), 1024 * 1024)
+        self.requested = []
+
+    def tearDown(self):
+        goglinks.time_budget.reset()
+        goglinks.file_index.reset()
+        self.folder.cleanup()
+
+    def download(self, img_url, file_path, connections = None, validators = None):
+        self.requested.append(img_url)
+        with open(file_path, 'wb') as f:
+            f.write(img_url.encode('utf-8'))
+        goglinks.file_index.add(file_path)
+        return {}
+
+    def download_images(self, output_folder, budget):
+        goglinks.time_budget.reset(budget)
+        games = goglinks.load_games(self.folder.name)
+        with mock.patch.object(goglinks, 'net_download_img', self.download):
+            downloader = goglinks.ImageDownloader(2, self.store)
+            for game in games:
+                goglinks.queue_images(game, goglinks.image_targets(game, output_folder, 'AEL'), output_folder, False,
+                    downloader)
+            return downloader.close()
+
+    def test_cached_images_placed_after_budget(self):
+        first = self.download_images(os.path.join(self.folder.name, 'first'), None)
+        self.requested = []
+        results = self.download_images(os.path.join(self.folder.name, 'second'), 0)
+        self.assertEqual(self.requested, [])
+        self.assertEqual(len(results), len(first))
+        self.assertTrue(all(result.status == goglinks.DownloadResult.OK for result in results))
+
+    def test_requests_deferred_after_budget(self):
+        results = self.download_images(self.output_folder, 0)
+        self.assertEqual(self.requested, [])
+        self.assertTrue(all(result.status == goglinks.DownloadResult.DEFERRED for result in results))
+
+    def test_deferred_images_fetched_by_next_watch_pass(self):
+        target = goglinks.RunTarget(self.output_folder, 'AEL', download_images=True)
+        fingerprints = {}
+        with mock.patch.object(goglinks, 'net_download_img', self.download):
+            goglinks.time_budget.reset(0)
+            self.assertTrue(goglinks.watch_pass(self.folder.name, [target], 2, goglinks.GALAXY_CLIENT_PATH, self.store,
+                fingerprints))
+            self.assertEqual(self.requested, [])
+
+            goglinks.time_budget.reset()
+            self.assertFalse(goglinks.watch_pass(self.folder.name, [target], 2, goglinks.GALAXY_CLIENT_PATH, self.store,
+                fingerprints))
+        games = goglinks.load_games(self.folder.name)
+        for game in games:
+            for _, url, path in goglinks.image_targets(game, self.output_folder, 'AEL'):
+                if url is not None:
+                    self.assertTrue(os.path.exists(path), path)
+
+if __name__ == '__main__':
+    unittest.main()
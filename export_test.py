@@ -0,0 +1,59 @@
+import os
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+
+import benchmark
+import goglinks
+
+def load_ael_games(xml_path):
+    # Read as AEL's offline scraper reads its XML databases: every <game> child of the
+    # root by its name attribute, with the text of each of its elements.
+    games = {}
+    for game_element in ET.parse(xml_path).getroot():
+        if game_element.tag != 'game':
+            continue
+        game = { 'name': game_element.attrib['name'] }
+        for child in game_element:
+            game[child.tag] = child.text if child.text is not None else ''
+        games[game['name']] = game
+    return games
+
+class CatalogExportTest(unittest.TestCase):
+    """The xml catalog is a multi-game database in the layout of AEL's offline scraper,
+    with the game named as the ROM name AEL gets from the game's lnk.
+    """
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        benchmark.create_synthetic_db(os.path.join(self.folder.name, 'galaxy-2.0.db'), 50)
+        self.games = goglinks.load_games(self.folder.name)
+
+    def tearDown(self):
+        goglinks.file_index.reset()
+        self.folder.cleanup()
+
+    def test_xml_catalog_read_as_ael_offline_database(self):
+        goglinks.export_catalog(self.games, self.folder.name, ['xml'])
+        root = ET.parse(os.path.join(self.folder.name, 'games.xml')).getroot()
+        self.assertEqual(root.tag, 'menu')
+        self.assertEqual(root.find('header/listname').text, goglinks.AEL_XML_LIST_NAME)
+
+        exported = load_ael_games(os.path.join(self.folder.name, 'games.xml'))
+        self.assertEqual(set(exported), set(game.fileTitle for game in self.games))
+        for game in self.games:
+            record = goglinks.nfo_record(game)
+            entry = exported[game.fileTitle]
+            for tag, field in goglinks.AEL_XML_FIELDS:
+                self.assertEqual(entry[tag], record[field] or '', '{} of {}'.format(tag, game.title))
+            for tag in ('sorttitle', 'platform', 'is_installed'):
+                self.assertEqual(entry[tag], record[tag] or '')
+
+    def test_xml_catalog_keeps_release_keys(self):
+        goglinks.export_catalog(self.games, self.folder.name, ['xml'])
+        root = ET.parse(os.path.join(self.folder.name, 'games.xml')).getroot()
+        self.assertEqual([element.attrib['releaseKey'] for element in root.iter('game')],
+            [game.id for game in self.games])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,21 +3,41 @@
 import sys, getopt
 import sqlite3
 import json
+try:
+    import orjson
+except ImportError:
+    orjson = None
 import errno
 import os
-from shutil import copyfile
+import ntpath
+import struct
+import shutil
 import pprint
 import string
-
-from datetime import datetime
+import hashlib
+import time
+import random
+import heapq
+import itertools
+
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import re
 import xml.etree.ElementTree as ET
-from xml.etree.ElementTree import Element, SubElement, Comment
-from xml.dom import minidom
 
 import http
+import http.client
 import urllib.request
+from urllib.parse import urlsplit, urljoin
+
+import threading
+import signal
+import cProfile
+import pstats
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, Future, wait as wait_futures
 
-import subprocess, sys
 import logging
 from logging.handlers import TimedRotatingFileHandler
 
@@ -26,6 +46,82 @@ from logging.handlers import TimedRotatingFileHandler
 # USER_AGENT = 'Mozilla/5.0 (Windows NT 6.1; WOW64; rv:54.0) Gecko/20100101 Firefox/68.0'
 USER_AGENT = 'Mozilla/5.0 (X11; Linux i586; rv:31.0) Gecko/20100101 Firefox/68.0'
 
+# GOG Galaxy client the game shortcuts start, override with -c/--client.
+GALAXY_CLIENT_PATH = 'E:\\Software\\GOG Galaxy\\GalaxyClient.exe'
+
+# Shell link (.lnk) format constants, see [MS-SHLLINK].
+LNK_CLSID = bytes.fromhex('0114020000000000c000000000000046')
+LNK_MY_COMPUTER_ITEM = bytes.fromhex('1f50e04fd020ea3a6910a2d808002b30309d')
+LNK_HAS_TARGET_ID_LIST = 0x01
+LNK_HAS_LINK_INFO = 0x02
+LNK_HAS_ARGUMENTS = 0x20
+LNK_IS_UNICODE = 0x80
+LNK_FILE_ATTRIBUTE_DIRECTORY = 0x10
+LNK_FILE_ATTRIBUTE_ARCHIVE = 0x20
+LNK_SW_SHOWNORMAL = 1
+LNK_VOLUME_ID_AND_LOCAL_BASE_PATH = 0x01
+LNK_DRIVE_FIXED = 3
+LNK_ANSI_ENCODING = 'cp1252'
+
+# Downloaded images are kept in a content addressed cache, by default in this folder
+# of the destination, and trimmed to this size in MB (least recently used first).
+IMAGE_CACHE_FOLDER = '.image_cache'
+DEFAULT_CACHE_SIZE = 2048
+
+# Number of images fetched in parallel and the per request timeout in seconds.
+DEFAULT_WORKERS = 8
+NET_TIMEOUT = 30
+NET_MAX_REDIRECTS = 5
+# Throttled (429), failing (5xx) and timed out requests are retried this many times, after
+# a random delay of up to NET_BACKOFF_BASE * 2^attempt seconds or what Retry-After asks for.
+NET_RETRIES = 4
+NET_BACKOFF_BASE = 1.0
+NET_BACKOFF_MAX = 60
+NET_RETRY_AFTER_MAX = 300
+# Images are streamed to disk in chunks of this size, into a temporary file with this suffix.
+NET_CHUNK_SIZE = 64 * 1024
+NET_PART_SUFFIX = '.part'
+# Images are downloaded in this order across the library, the extrasnaps (snap#1 and up)
+# last, and within each kind those of installed games first.
+IMAGE_PRIORITIES = { 'cover': 0, 'icon': 1, 'fanart': 2, 'snap': 3, 'snap#0': 3 }
+IMAGE_PRIORITY_EXTRA = 4
+
+# In watch mode the GOG db is checked for changes every WATCH_POLL_INTERVAL seconds, and a
+# pass starts once it has not changed for the debounce interval, so a sync is handled once.
+# A pass that left work undone, like failed or deferred images, is run again after
+# WATCH_RETRY_INTERVAL seconds when the db did not change before.
+WATCH_POLL_INTERVAL = 2
+WATCH_DEBOUNCE = 30
+WATCH_RETRY_INTERVAL = 300
+
+# Upper bounds in seconds of the buckets of the image request latency histogram, sorted
+# and unique as Prometheus requires.
+METRICS_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+METRICS_PREFIX = 'goglinks'
+
+# orjson is optional, it decodes the GamePieces JSON a lot faster when installed.
+json_loads = orjson.loads if orjson is not None else json.loads
+
+# NFO files are indented with two spaces per level.
+XML_INDENT = '  '
+XML_INVALID_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+# The fields of the NFO files, and of the catalog exports, in the order they are written.
+NFO_TEXT_FIELDS = ('title', 'sorttitle', 'year', 'genre', 'developer', 'rating', 'plot', 'themes', 'premiered',
+    'platform', 'is_installed')
+NFO_IMAGE_FIELDS = ('fanart', 'cover', 'icon')
+
+# Catalog export formats and the file each is written to in the destination, see CatalogExport.
+EXPORT_FILES = { 'xml': 'games.xml', 'jsonl': 'games.jsonl', 'sqlite': 'games.db' }
+# The elements of a game in AEL's offline scraper XML and the NFO field each holds, written
+# first. The other NFO fields follow under their NFO tags.
+AEL_XML_FIELDS = (('description', 'title'), ('year', 'year'), ('genre', 'genre'), ('manufacturer', 'developer'),
+    ('rating', 'rating'), ('story', 'plot'))
+AEL_XML_LIST_NAME = 'GOG Galaxy'
+
+# Marks a lazily decoded field that has not been read yet.
+_UNSET = object()
+
 logger = logging.getLogger('gog_links')
 logger.setLevel(logging.DEBUG)
 formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -34,21 +130,90 @@ handler = TimedRotatingFileHandler('gog_links.log', when='D',interval=1, backupC
 handler.setFormatter(formatter)
 logger.addHandler(handler)
 
+# All owned, visible, non DLC releases with their GamePieces pivoted into columns.
+# GamePieces is scanned once and grouped per releaseKey instead of joined once per
+# piece type, and platforms are matched on the releaseKey prefix ("steam_1234")
+# so the join is an equality lookup. The pivot is LEFT JOINed so SQLite keeps
+# UserReleaseProperties as the outer loop; releases missing one of the six pieces
+# are dropped by the WHERE clause, as the former INNER JOINs did.
+# Keep query.sql in sync with this query.
+GAMES_QUERY = '''
+SELECT
+     u.userId, u.isHidden, r.*
+    ,p.id AS platformId
+    ,IFNULL(p.name, "gog") AS platform
+    ,gp.title
+    ,gp.summary
+    ,gp.meta
+    ,gp.media
+    ,gp.images
+    ,gp.sort
+    ,CASE
+        WHEN prk.externalId IS NULL AND ig.productId IS NULL THEN 0
+        WHEN prk.externalId IS NOT NULL AND ie.id IS NULL THEN 0
+        ELSE 1
+    END AS Installed
+FROM UserReleaseProperties AS u
+    LEFT JOIN ReleaseProperties AS r ON u.releaseKey = r.releaseKey
+    LEFT JOIN (
+        SELECT gps.releaseKey
+            ,MAX(CASE WHEN gpt.type = 'title' THEN gps.value END) AS title
+            ,MAX(CASE WHEN gpt.type = 'summary' THEN gps.value END) AS summary
+            ,MAX(CASE WHEN gpt.type = 'meta' THEN gps.value END) AS meta
+            ,MAX(CASE WHEN gpt.type = 'media' THEN gps.value END) AS media
+            ,MAX(CASE WHEN gpt.type = 'originalImages' THEN gps.value END) AS images
+            ,MAX(CASE WHEN gpt.type = 'sortingTitle' THEN gps.value END) AS sort
+        FROM GamePieces AS gps
+            INNER JOIN GamePieceTypes AS gpt ON gps.gamePieceTypeId = gpt.id
+        WHERE gpt.type IN ('title', 'summary', 'meta', 'media', 'originalImages', 'sortingTitle')
+        GROUP BY gps.releaseKey
+    ) AS gp ON r.releaseKey = gp.releaseKey
+    LEFT JOIN ProductsToReleaseKeys AS prk ON r.releaseKey = prk.releaseKey
+    LEFT JOIN Platforms AS p ON p.name = SUBSTR(r.releaseKey, 1, INSTR(r.releaseKey, '_') - 1)
+    LEFT JOIN InstalledBaseProducts AS ig ON ig.productId = prk.gogId
+    LEFT JOIN InstalledExternalProducts AS ie ON ie.id = prk.externalId
+WHERE isVisibleInLibrary = 1 AND isDlc = 0 AND u.isHidden = 0
+    AND gp.title IS NOT NULL AND gp.summary IS NOT NULL AND gp.meta IS NOT NULL
+    AND gp.media IS NOT NULL AND gp.images IS NOT NULL AND gp.sort IS NOT NULL
+'''
+
 def main(argv):
 
     gog_path = None
+    output_folder = None
+    config_file = None
+    users = None
+    exports = []
+    shield_folder = None
     folder_style = "AEL"
     create_nfo_flag = False
     download_images_flag = False
     create_lnks_flag = False
     overwrite_files_flag = False
     add_to_shield = False
-
-    example = 'main.py -g <GOG path> -d <destination path>'
+    stream_flag = False
+    watch_flag = False
+    snapshot_flag = False
+    plan_flag = False
+    debounce = WATCH_DEBOUNCE
+    budget = None
+    workers = DEFAULT_WORKERS
+    client_path = GALAXY_CLIENT_PATH
+    cache_folder = None
+    cache_size = DEFAULT_CACHE_SIZE
+    metrics_json = None
+    metrics_prom = None
+    profile_file = None
+
+    example = 'main.py (-g <GOG path> -d <destination path> [-u <GOG user id>]... | --config <run config.json>) ' + \
+        '[-w <download workers>] [-c <GalaxyClient.exe path>] [--shield <Shield Apps path>] ' + \
+        '[--cache <image cache path>] [--cache-size <MB, 0 disables>] [--stream] [--watch [--debounce <seconds>]] [--snapshot] [--plan] [--time-budget <seconds>] [--export <xml|jsonl|sqlite>]... ' + \
+        '[--metrics-json <file>] [--metrics-prom <file>] [--profile <file>] [--log-level <level>]'
 
     try:
-        opts, args = getopt.getopt(argv,"hg:d:nois:la", \
-            ["gog=","destination=","nfo","overwrite","img","style=", "lnk", "add"])
+        opts, args = getopt.getopt(argv,"hg:d:nois:law:c:u:", \
+            ["gog=","destination=","user=","config=","nfo","overwrite","img","style=", "lnk", "add", "shield=", "workers=", "client=", "stream", "cache=", "cache-size=",
+             "watch", "debounce=", "snapshot", "plan", "time-budget=", "export=", "metrics-json=", "metrics-prom=", "profile=", "log-level="])
     except getopt.GetoptError:
         print(example)
         sys.exit(2)
@@ -61,8 +226,34 @@ def main(argv):
             gog_path = arg
         if opt in ("-d", "--destination"):
             output_folder = arg
+        if opt in ("-u", "--user"):
+            try:
+                users = (users or []) + [int(arg)]
+            except ValueError:
+                print(example)
+                sys.exit(2)
+        if opt == "--config":
+            config_file = arg
         if opt in ("-s", "--style"):
             folder_style = arg
+        if opt in ("-c", "--client"):
+            client_path = arg
+        if opt == "--shield":
+            shield_folder = arg
+        if opt in ("-w", "--workers"):
+            try:
+                workers = max(1, int(arg))
+            except ValueError:
+                print(example)
+                sys.exit(2)
+        if opt == "--cache":
+            cache_folder = arg
+        if opt == "--cache-size":
+            try:
+                cache_size = max(0, int(arg))
+            except ValueError:
+                print(example)
+                sys.exit(2)
 
         if opt in ("-n", "--nfo"):
             create_nfo_flag = True
@@ -74,14 +265,183 @@ def main(argv):
             add_to_shield = True
         if opt in ("-o", "--overwrite"):
             overwrite_files_flag = True
+        if opt == "--stream":
+            stream_flag = True
+        if opt == "--watch":
+            watch_flag = True
+        if opt == "--snapshot":
+            snapshot_flag = True
+        if opt == "--plan":
+            plan_flag = True
+        if opt == "--time-budget":
+            try:
+                budget = max(0, float(arg))
+            except ValueError:
+                print(example)
+                sys.exit(2)
+        if opt == "--export":
+            if arg not in EXPORT_FILES:
+                print(example)
+                sys.exit(2)
+            exports.append(arg)
+        if opt == "--debounce":
+            try:
+                debounce = max(0, float(arg))
+            except ValueError:
+                print(example)
+                sys.exit(2)
+        if opt == "--metrics-json":
+            metrics_json = arg
+        if opt == "--metrics-prom":
+            metrics_prom = arg
+        if opt == "--profile":
+            profile_file = arg
+        if opt == "--log-level":
+            level = logging.getLevelName(arg.upper())
+            if not isinstance(level, int):
+                print(example)
+                sys.exit(2)
+            logger.setLevel(level)
+
+    if config_file is not None:
+        try:
+            config = load_config(config_file)
+        except (OSError, ValueError) as ex:
+            print('Cannot read run config {}: {}'.format(config_file, ex))
+            sys.exit(2)
+        gog_path = config.get('gog', gog_path)
+        workers = max(1, int(config.get('workers', workers)))
+        client_path = config.get('client', client_path)
+        cache_folder = config.get('cache', cache_folder)
+        cache_size = max(0, int(config.get('cache-size', cache_size)))
+        snapshot_flag = config.get('snapshot', snapshot_flag)
+        budget = config.get('time-budget', budget)
+        targets = config['targets']
+    else:
+        if output_folder is None:
+            print(example)
+            sys.exit(2)
+        targets = [RunTarget(output_folder, folder_style, create_nfo_flag, download_images_flag, create_lnks_flag,
+            add_to_shield, overwrite_files_flag, users, exports, shield_folder)]
 
     if gog_path is None:
         print(example)
         sys.exit(2)
+    if stream_flag and len(targets) > 1:
+        print('--stream runs a single target')
+        sys.exit(2)
+
+    if plan_flag:
+        plan(gog_path, targets, workers, snapshot_flag)
+        return
+
+    # One image cache for all targets, so an image used by several targets is downloaded once.
+    store = None
+    if any(target.download_images for target in targets) and cache_size > 0:
+        store = ImageStore(cache_folder or os.path.join(targets[0].output_folder, IMAGE_CACHE_FOLDER),
+            cache_size * 1024 * 1024)
+
+    profiler = None
+    if profile_file is not None:
+        profiler = ThreadProfiler()
+        profiler.enable()
+
+    # Saves the cache index, the manifest and the metrics. After the run, and in
+    # watch mode after every pass, so a killed watcher loses at most one pass.
+    def save_state():
+        rate_control.log_summary()
+        if store is not None:
+            store.close()
+            metrics.set('image_cache_hits', store.hits)
+            metrics.set('image_cache_revalidated', store.revalidated)
+            metrics.set('image_cache_misses', store.misses)
+        for target in targets:
+            if target.manifest is not None:
+                target.manifest.save()
+        if metrics_json is not None:
+            metrics.write_json(metrics_json)
+        if metrics_prom is not None:
+            metrics.write_prometheus(metrics_prom)
+
+    metrics.reset()
+    rate_control.reset(workers)
+    time_budget.reset(budget)
+    try:
+        if watch_flag:
+            watch_games(gog_path, targets, workers, client_path, store, save_state, debounce, snapshot = snapshot_flag)
+        else:
+            run(gog_path, targets, workers, client_path, store, stream_flag, snapshot_flag)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_file)
+            logger.info('Profile written to {}'.format(profile_file))
+        save_state()
+
+def load_config(config_path):
+    """Reads a run configuration, a JSON file like:
+
+    {
+        "gog": "C:/ProgramData/GOG.com/Galaxy/storage",
+        "users": [ 12345 ],
+        "workers": 8, "client": "...", "cache": "...", "cache-size": 2048, "snapshot": true, "shield": "...",
+        "time-budget": 600,
+        "targets": [
+            { "destination": "D:/AEL", "style": "AEL", "nfo": true, "img": true, "lnk": true, "add": true },
+            { "destination": "D:/Kodi", "style": "KODI", "img": true, "export": [ "jsonl" ], "users": [ 12345, 67890 ] }
+        ]
+    }
+
+    The keys are the long command line options. "users" limits a target to the games of
+    those GOG user ids, the top level "users" is the default of the targets.
+    Returns the settings with "targets" as a list of RunTarget.
+    """
+    with open(config_path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+
+    default_users = config.get('users')
+    shield_folder = config.get('shield')
+    targets = []
+    for entry in config.get('targets', []):
+        if 'destination' not in entry:
+            raise ValueError('target without destination')
+        users = entry.get('users', default_users)
+        targets.append(RunTarget(entry['destination'], entry.get('style', 'AEL'), entry.get('nfo', False),
+            entry.get('img', False), entry.get('lnk', False), entry.get('add', False), entry.get('overwrite', False),
+            [int(user) for user in users] if users is not None else None, entry.get('export'),
+            entry.get('shield', shield_folder)))
+        for fmt in targets[-1].exports:
+            if fmt not in EXPORT_FILES:
+                raise ValueError('unknown export format {}'.format(fmt))
+    if not targets:
+        raise ValueError('no targets')
+    config['targets'] = targets
+    if config.get('time-budget') is not None:
+        try:
+            config['time-budget'] = max(0, float(config['time-budget']))
+        except (TypeError, ValueError):
+            raise ValueError('time-budget is not a number of seconds')
+    return config
+
+def run(gog_path, targets, workers, client_path, store, stream_flag, snapshot_flag = False):
+
+    if stream_flag:
+        target = targets[0]
+        try:
+            with metrics.stage('stream'):
+                stream_games(gog_path, target.output_folder, target.create_nfo, target.download_images, target.create_lnks,
+                    target.add_to_shield, target.overwrite, target.folder_style, workers, client_path, store, target.manifest,
+                    snapshot_flag, target.users, target.exports, target.shield_folder)
+        except Exception as ex:
+            logger.error('(Exception) Object type "{}"'.format(type(ex)))
+            logger.error('(Exception) Message "{}"'.format(str(ex)))
+            logger.error('Streaming games from db stopped')
+        return
 
     # load games from GOG db
     try:
-        games = load_games(gog_path)
+        with metrics.stage('load'):
+            games = load_games(gog_path, snapshot_flag, RunTarget.all_users(targets))
     except Exception as ex:
         logger.error('(Exception) Object type "{}"'.format(type(ex)))
         logger.error('(Exception) Message "{}"'.format(str(ex)))
@@ -89,44 +449,420 @@ def main(argv):
         return
     
     logger.info('loaded {} games'.format(len(games)))
-
-    # create NFO files
-    if create_nfo_flag:
-        logger.info('Creating NFO files for the games')
-        create_nfos(games, output_folder, overwrite_files_flag)
-        logger.info('NFO files done')
-
-    # download images
+    metrics.stage_games('load', len(games))
+    index_targets(targets)
+
+    for target in targets:
+        target_games = target.select(games)
+        if len(targets) > 1:
+            logger.info('Target {} ({}): {} games'.format(target.output_folder, target.folder_style, len(target_games)))
+        if target.manifest is not None:
+            for game in target_games:
+                target.manifest.keep(game)
+
+        run_target(target, target_games, workers, client_path, store)
+        if target.exports:
+            with metrics.stage('export', len(target_games)):
+                export_catalog(target_games, target.output_folder, target.exports)
+
+        if target.manifest is not None:
+            with metrics.stage('prune'):
+                target.manifest.prune()
+
+def index_targets(targets):
+    # One scandir walk per output folder, and of the Shield folder when it is synced.
+    with metrics.stage('index'):
+        file_index.reset()
+        for target in targets:
+            file_index.scan(target.output_folder)
+        for shield_folder in set(geforce_folders(target.shield_folder)[1] for target in targets if target.add_to_shield):
+            file_index.scan(shield_folder)
+
+def run_target(target, games, workers, client_path, store, library = None, stop = None):
+    return run_stages(games, target.output_folder, target.create_nfo, target.download_images, target.create_lnks,
+        target.add_to_shield, target.overwrite, target.folder_style, workers, client_path, store, target.manifest,
+        target.shield_folder, library, stop)
+
+def run_stages(games, output_folder, create_nfo_flag, download_images_flag, create_lnks_flag, add_to_shield, \
+        overwrite_files_flag, folder_style, workers, client_path, store, manifest, shield_folder = None, library = None, \
+        stop = None):
+    """Runs the enabled stages for the games as a TaskGraph, with per game tasks:
+
+    nfo     render and write the NFO                   disk executor, workers threads
+    images  download the images, by priority           the ImageDownloader, workers threads
+    lnk     write the lnk                              disk executor
+    geforce read the GeForce journal, once             shield executor, one thread
+    shield  mirror the lnk and box-art, after the      shield executor
+            game's lnk and cover and the journal
+
+    library are all games of the target, when only some of them are run. The Shield
+    entries of the other games are kept.
+    When stop is set, or the run is interrupted, the tasks and images that did not start
+    yet are cancelled and only the running ones are waited for.
+    Returns the ids of the games with a task that failed or was cancelled, or an image
+    that was not downloaded.
+    """
+    nfo_folder = os.path.join(output_folder, 'games')
+    if create_nfo_flag or create_lnks_flag:
+        file_index.makedirs(nfo_folder)
+    downloader = None
     if download_images_flag:
-        logger.info('Downloading images for the games')
-        download_images(games, output_folder, overwrite_files_flag, folder_style)
-        logger.info('Downloading complete')
-
-    # create lnk files
-    if create_lnks_flag:
-        logger.info('Creating lnks for the games')
-        create_lnks(games, output_folder, overwrite_files_flag)
-        logger.info('Creating lnks complete')
-
+        if folder_style == 'AEL':
+            create_ael_folders(output_folder)
+        downloader = ImageDownloader(workers, store)
+
+    disk_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='disk')
+    shield_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='shield')
+    graph = TaskGraph({ 'disk': disk_pool, 'shield': shield_pool })
+    recognized = None
     if add_to_shield:
-        #C:\Users\<USER>\AppData\Local\NVIDIA Corporation\Shield Apps
-        user_folder = os.path.expanduser('~')
-        user_folder = os.path.join(user_folder, 'AppData', 'Local')
-        nvidia_folder = os.path.join(user_folder, 'NVIDIA', 'NvBackend')
-        shield_apps_folder = os.path.join(user_folder, 'NVIDIA Corporation', 'Shield Apps')
-
-        logger.info('Gathering already recognized games by nvidia')
+        nvidia_folder, shield_apps_folder = geforce_folders(shield_folder)
+        mirror = ShieldMirror(output_folder, shield_apps_folder)
+        recognized = graph.add('geforce', 'shield', load_games_from_geforce, nvidia_folder)
+
+    logger.info('Running the stages for {} games'.format(len(games)))
+    results = []
+    tasks = []
+    images = []
+    completed = False
+    try:
+        # All images are queued before they start, so they download in priority order across the games.
+        covers = [None] * len(games)
+        if downloader is not None:
+            with downloader.hold():
+                for i, game in enumerate(games):
+                    futures = queue_images(game, image_targets(game, output_folder, folder_style), output_folder,
+                        overwrite_files_flag, downloader, manifest)
+                    for future in futures:
+                        graph.track('images', future)
+                        if future is not None:
+                            images.append((game, future))
+                    covers[i] = futures[0]
+
+        # Releases that share a file title write the same NFO and lnk. Their tasks run one
+        # after the other, in the order of the serial loop, so the files never interleave.
+        nfos = {}
+        lnks = {}
+        for game, cover in zip(games, covers):
+            file_title = os.path.normcase(game.fileTitle)
+            if create_nfo_flag:
+                nfos[file_title] = graph.add('nfo', 'disk', create_nfo, game, nfo_folder, overwrite_files_flag,
+                    manifest, deps=(nfos.get(file_title),))
+                tasks.append((game, nfos[file_title]))
+
+            lnk = None
+            if create_lnks_flag:
+                lnk = lnks[file_title] = graph.add('lnk', 'disk', create_lnk, game, nfo_folder, client_path,
+                    overwrite_files_flag, deps=(lnks.get(file_title),))
+                tasks.append((game, lnk))
+
+            if add_to_shield:
+                tasks.append((game, graph.add('shield', 'shield', lambda game: add_game_to_shield(game,
+                    recognized.result(), output_folder, mirror, overwrite_files_flag), game, deps=(recognized, lnk, cover))))
+        completed = graph.wait(stop)
+    finally:
+        if not completed:
+            logger.info('Stopping, cancelling the tasks and images that did not start yet')
+            graph.cancel()
+            if downloader is not None:
+                downloader.cancel()
+            graph.wait()
+        disk_pool.shutdown(cancel_futures=not completed)
+        shield_pool.shutdown(cancel_futures=not completed)
+        if downloader is not None:
+            results = downloader.close(cancel=not completed)
+
+    if not completed:
+        return set(game.id for game in games)
+    if downloader is not None:
+        metrics.stage_games('images', len(games))
+        log_download_results(results)
+    if add_to_shield and recognized.exception() is None:
+        sweep_shield(mirror, recognized.result(), library if library is not None else games)
+    logger.info('Stages complete')
+
+    # create_nfo and create_lnk log their errors and leave the file missing, see
+    # RunTarget.incomplete, add_game_to_shield returns False on one.
+    failed = set(game.id for game, future in images if DownloadResult.missing(future))
+    failed.update(game.id for game, future in tasks if future.cancelled() or future.exception() is not None or \
+        future.result() is False)
+    return failed
+
+def plan(gog_path, targets, workers, snapshot = False):
+    """Prints the tasks a run would make and the work they would do, see run_stages.
+    Reads the db, the output folders and the GeForce journal, writes nothing and
+    makes no requests.
+    """
+    games = load_games(gog_path, snapshot, RunTarget.all_users(targets))
+    index_targets(targets)
+    print('{} games in the GOG db'.format(len(games)))
+    print('Executors: disk {} threads (nfo, lnk), images {} workers, shield 1 thread (geforce, shield)'.format(
+        workers, workers))
+
+    for target in targets:
+        target_games = target.select(games)
+        print('')
+        print('Target {} ({}), {} games'.format(target.output_folder, target.folder_style, len(target_games)))
+        work = plan_target(target, target_games)
+        print('Estimated work:')
+        for stage, (todo, total, action) in work.items():
+            print('  {:8} {} of {} {}'.format(stage, todo, total, action))
+
+def plan_target(target, games):
+    # Prints the tasks of every game, returns per stage (to do, tasks, what is done).
+    nfo_folder = os.path.join(target.output_folder, 'games')
+    manifest = target.manifest
+    work = {}
+    def task(stage, label, todo, action, deps = ()):
+        counts = work.setdefault(stage, [0, 0, action])
+        counts[1] += 1
+        if todo:
+            counts[0] += 1
+        print('  {:8} {}{}{}'.format(stage, label, '' if todo else ' (up to date)',
+            ' after {}'.format(', '.join(deps)) if deps else ''))
+        return todo
+
+    recognized_games = None
+    if target.add_to_shield:
+        nvidia_folder, shield_apps_folder = geforce_folders(target.shield_folder)
         recognized_games = load_games_from_geforce(nvidia_folder)
-        logger.info('Done gathering recognized games')
+        task('geforce', os.path.join(nvidia_folder, 'journalBS.main.xml'), True, 'journal to read')
 
-        logger.info('Adding lnks to shield')
-        add_games_to_shield(games, recognized_games, output_folder, shield_apps_folder, overwrite_files_flag)
-        logger.info('Adding lnks to shield complete')
+    for game in games:
+        print(' {} [{}]'.format(game.title, game.id))
+        if target.create_nfo:
+            path = os.path.join(nfo_folder, '{}.nfo'.format(game.fileTitle))
+            task('nfo', path, target.overwrite or (manifest is not None and manifest.changed(game, SyncManifest.NFO)) or \
+                not file_index.exists(path), 'NFOs to write')
+
+        deps = ['geforce']
+        if target.download_images:
+            refresh = target.overwrite or (manifest is not None and manifest.changed(game, SyncManifest.IMAGES))
+            for kind, url, path in image_targets(game, target.output_folder, target.folder_style):
+                if url is not None:
+                    task('images', '{} {}'.format(kind, path), refresh or not file_index.exists(path), 'images to download')
+            if game.cover is not None:
+                deps.append('cover')
+
+        lnk_path = os.path.join(nfo_folder, '{}.lnk'.format(game.fileTitle))
+        if target.create_lnks:
+            task('lnk', lnk_path, target.overwrite or not file_index.exists(lnk_path), 'lnks to write')
+            deps.append('lnk')
+
+        if target.add_to_shield:
+            recognized, _ = recognized_games.match(game)
+            if recognized is not None:
+                task('shield', '{} recognized as {}'.format(game.fileTitle, recognized.title), False,
+                    'entries to mirror', deps)
+            else:
+                # Up to date when the mirrored files have the size and mtime of their sources.
+                shield_lnk = os.path.join(shield_apps_folder, '{}.lnk'.format(game.fileTitle))
+                shield_img = os.path.join(shield_apps_folder, 'StreamingAssets', game.fileTitle, 'box-art.png')
+                img_path = os.path.join(target.output_folder, 'boxfronts', '{}.png'.format(game.fileTitle))
+                todo = file_index.stat(lnk_path) is None or file_index.stat(lnk_path) != file_index.stat(shield_lnk) or \
+                    file_index.stat(img_path) != file_index.stat(shield_img)
+                task('shield', shield_lnk, todo, 'entries to mirror', deps)
+    return work
+
+def watch_games(gog_path, targets, workers, client_path, store, after_pass = None, debounce = WATCH_DEBOUNCE, \
+        stop = None, snapshot = False):
+    """Keeps the output in sync with the GOG db until stop is set, Ctrl+C is pressed
+    or the process is terminated. The first pass handles the whole library, later
+    passes only the games whose GamePieces or install state changed since the
+    previous pass, the games that left the library and the games whose files are
+    missing, like images that failed or were deferred, or files deleted meanwhile.
+    """
+    if stop is None:
+        stop = threading.Event()
+    if threading.current_thread() is threading.main_thread():
+        for name in ('SIGTERM', 'SIGBREAK'):
+            if hasattr(signal, name):
+                signal.signal(getattr(signal, name), lambda signum, frame: stop.set())
+
+    watcher = GalaxyDbWatcher(os.path.join(gog_path, 'galaxy-2.0.db'))
+    fingerprints = {}
+    try:
+        while not stop.is_set():
+            retry = True
+            try:
+                # Every pass gets the whole time budget.
+                time_budget.restart()
+                retry = watch_pass(gog_path, targets, workers, client_path, store, fingerprints, snapshot, stop)
+            except Exception as ex:
+                logger.error('(Exception) Object type "{}"'.format(type(ex)))
+                logger.error('(Exception) Message "{}"'.format(str(ex)))
+                logger.error('Watch pass failed, retrying')
+            if after_pass is not None:
+                after_pass()
+
+            # Wait for a change, or the retry interval when the pass left work undone, then
+            # until the db has been quiet for the debounce interval.
+            retry_at = time.monotonic() + WATCH_RETRY_INTERVAL if retry else None
+            while not stop.wait(WATCH_POLL_INTERVAL) and not watcher.changed():
+                if retry_at is not None and time.monotonic() >= retry_at:
+                    logger.info('Retrying the work the previous pass left undone')
+                    break
+            quiet_since = time.monotonic()
+            while not stop.is_set() and time.monotonic() - quiet_since < debounce:
+                stop.wait(min(WATCH_POLL_INTERVAL, debounce))
+                if watcher.changed():
+                    quiet_since = time.monotonic()
+    except KeyboardInterrupt:
+        logger.info('Watch interrupted')
+    finally:
+        watcher.close()
+    logger.info('Watch stopped')
+
+def watch_pass(gog_path, targets, workers, client_path, store, fingerprints, snapshot = False, stop = None):
+    """Runs the games that changed since the previous pass, or are incomplete in a target,
+    see RunTarget.incomplete. Returns True when work was left undone.
+    fingerprints holds the NFO fingerprint, which covers all GamePieces and the install
+    state, of every game seen in the previous pass. It is updated once the pass is through,
+    without the games that failed, so those are run again by the next pass.
+    """
+    with metrics.stage('load'):
+        games = load_games(gog_path, snapshot, RunTarget.all_users(targets))
+    metrics.stage_games('load', len(games))
+
+    current = { (game.user_id, game.id): game.fingerprint(SyncManifest.NFO) for game in games }
+    changed = [game for game in games if fingerprints.get((game.user_id, game.id)) != current[(game.user_id, game.id)]]
+    changed_ids = set(game.id for game in changed)
+    removed = len(set(fingerprints) - set(current))
+    logger.info('Watch pass: {} games, {} changed, {} removed'.format(len(games), len(changed), removed))
+    # Scanned every pass, so files deleted since the previous one are found missing.
+    index_targets(targets)
+
+    failed = set()
+    for target in targets:
+        if stop is not None and stop.is_set():
+            failed.update(game.id for game in games)
+            break
+        target_games = target.select(games)
+        if target.manifest is not None:
+            for game in target_games:
+                target.manifest.keep(game)
+        target_changed = [game for game in target_games if game.id in changed_ids or target.incomplete(game)]
+        incomplete = sum(1 for game in target_changed if game.id not in changed_ids)
+        if incomplete:
+            logger.info('{} unchanged games incomplete in {}'.format(incomplete, target.output_folder))
+        if target_changed or (removed and target.add_to_shield):
+            failed.update(run_target(target, target_changed, workers, client_path, store, target_games, stop))
+            failed.update(game.id for game in target_changed if target.incomplete(game))
+        # The catalogs hold the whole library, they are written again on any change.
+        if target.exports and (changed or removed):
+            with metrics.stage('export'):
+                export_catalog(target.select(games), target.output_folder, target.exports)
+        if target.manifest is not None:
+            with metrics.stage('prune'):
+                target.manifest.prune()
+
+    fingerprints.clear()
+    fingerprints.update((key, fingerprint) for key, fingerprint in current.items() if key[1] not in failed)
+    if failed:
+        logger.info('Watch pass left {} games incomplete'.format(len(failed)))
+    return bool(failed)
+
+def stream_games(gog_path, output_folder, create_nfo_flag, download_images_flag, create_lnks_flag, \
+        add_to_shield, overwrite_existing, folder_style, workers = DEFAULT_WORKERS, client_path = GALAXY_CLIENT_PATH, \
+        store = None, manifest = None, snapshot = False, users = None, exports = None, shield_folder = None):
+    """Runs every enabled stage for a game as soon as it is read from the db.
+    Memory stays flat and output appears from the first game on.
+    """
+    nfo_folder = os.path.join(output_folder, 'games')
+    file_index.reset()
+    file_index.scan(output_folder)
+    if (create_nfo_flag or create_lnks_flag):
+        file_index.makedirs(nfo_folder)
 
-def load_games(path):
+    downloader = None
+    if download_images_flag:
+        if folder_style == 'AEL':
+            create_ael_folders(output_folder)
+        downloader = ImageDownloader(workers, store)
+    recognized_games = RecognizedGames()
+    if add_to_shield:
+        nvidia_folder, shield_apps_folder = geforce_folders(shield_folder)
+        recognized_games = load_games_from_geforce(nvidia_folder)
+        file_index.scan(shield_apps_folder)
+        mirror = ShieldMirror(output_folder, shield_apps_folder)
+    catalogs = [CatalogExport(output_folder, fmt) for fmt in exports or []]
+
+    # Shield entries copy the box-art, so a game waits here until its cover is downloaded.
+    shield_queue = deque()
+    def flush_shield_queue(wait):
+        while shield_queue and (wait or shield_queue[0][1] is None or shield_queue[0][1].done()):
+            game, _ = shield_queue.popleft()
+            add_game_to_shield(game, recognized_games, output_folder, mirror, overwrite_existing)
+
+    count = 0
+    completed = False
+    seen = set()
+    try:
+        for game in iter_games(gog_path, snapshot, users):
+            # A release owned by several of the users is handled once.
+            if game.id in seen:
+                continue
+            seen.add(game.id)
+            count += 1
+            if create_nfo_flag:
+                create_nfo(game, nfo_folder, overwrite_existing, manifest)
+
+            cover = None
+            if downloader is not None:
+                cover = queue_images(game, image_targets(game, output_folder, folder_style), output_folder,
+                    overwrite_existing, downloader, manifest)[0]
+
+            if manifest is not None:
+                manifest.keep(game)
+
+            if create_lnks_flag:
+                create_lnk(game, nfo_folder, client_path, overwrite_existing)
+
+            for catalog in catalogs:
+                catalog.write(game)
+
+            if add_to_shield:
+                mirror.keep(game.fileTitle)
+                shield_queue.append((game, cover))
+                flush_shield_queue(False)
+        completed = True
+    finally:
+        if downloader is not None:
+            log_download_results(downloader.close(cancel=not completed))
+        for catalog in catalogs:
+            catalog.close(completed)
+
+    flush_shield_queue(True)
+    if add_to_shield:
+        mirror.sweep()
+        mirror.save()
+        recognized_games.log_matches()
+    if manifest is not None:
+        manifest.prune()
+    metrics.stage_games('stream', count)
+    logger.info('streamed {} games'.format(count))
+
+def geforce_folders(shield_folder = None):
+    #C:\Users\<USER>\AppData\Local\NVIDIA Corporation\Shield Apps
+    # shield_folder replaces the Shield Apps folder, for instance with a local stand-in.
+    user_folder = os.path.expanduser('~')
+    user_folder = os.path.join(user_folder, 'AppData', 'Local')
+    nvidia_folder = os.path.join(user_folder, 'NVIDIA', 'NvBackend')
+    shield_apps_folder = shield_folder or os.path.join(user_folder, 'NVIDIA Corporation', 'Shield Apps')
+    return nvidia_folder, shield_apps_folder
+
+def load_games(path, snapshot = False, users = None):
+    return list(iter_games(path, snapshot, users))
+
+def iter_games(path, snapshot = False, users = None):
+    """Yields the games from the GOG db one by one, as they are read from the cursor.
+    With snapshot they are read from an in-memory copy of the db, see connect_galaxy_db.
+    With users only the games of those GOG user ids are read. A release owned by
+    more than one user is yielded once per user.
+    """
     db_path = os.path.join(path, 'galaxy-2.0.db')
     logger.debug('connecting to db@{}'.format(db_path))
-    conn = sqlite3.connect(db_path)
+    conn = connect_galaxy_db(db_path, snapshot)
     conn.row_factory = dict_factory
     c = conn.cursor()
     
@@ -139,333 +875,769 @@ def load_games(path):
     #	PlayTasks   (SELECT * FROM PlayTasks p left join PlayTaskTypes  pt on  p.typeid = pt.id  left join PlayTaskLaunchParameters as pp on p.id = pp.playtaskid)
     #	ReleaseProperties (releaseKey	isDlc	isVisibleInLibrary	gameId)
 
-    q = 'SELECT \
-             u.userId, u.isHidden, r.* \
-            ,p.id AS platformId \
-            ,IFNULL(p.name, "gog") AS platform \
-            ,gpt.value as title \
-            ,gps.value as summary \
-            ,gpm.value as meta \
-            ,gpmd.value as media \
-            ,gpi.value as images \
-            ,gpo.value AS sort \
-            ,CASE \
-                WHEN prk.externalId IS NULL AND ig.productId IS NULL THEN 0 \
-                WHEN prk.externalId IS NOT NULL AND ie.id IS NULL THEN 0 \
-                ELSE 1 \
-            END AS Installed \
-        FROM UserReleaseProperties AS u \
-            LEFT JOIN ReleaseProperties AS r ON u.releaseKey = r.releaseKey \
-            LEFT JOIN ProductsToReleaseKeys AS prk ON r.releaseKey = prk.releaseKey \
-            LEFT JOIN Platforms AS p ON INSTR(r.releaseKey, p.name) > 0 \
-            LEFT JOIN GamePieces AS gpt ON r.releaseKey = gpt.releaseKey \
-                INNER JOIN GamePieceTypes gtypes1 ON gpt.gamePieceTypeId = gtypes1.Id AND gtypes1.type = \'title\' \
-            LEFT JOIN GamePieces AS gps ON r.releaseKey = gps.releaseKey \
-                INNER JOIN GamePieceTypes gtypes2 ON gps.gamePieceTypeId = gtypes2.Id AND gtypes2.type = \'summary\' \
-            LEFT JOIN GamePieces AS gpm  ON r.releaseKey = gpm.releaseKey \
-                INNER JOIN GamePieceTypes gtypes3 ON gpm.gamePieceTypeId = gtypes3.Id AND gtypes3.type = \'meta\' \
-            LEFT JOIN GamePieces AS gpmd ON r.releaseKey = gpmd.releaseKey \
-                INNER JOIN GamePieceTypes gtypes4 ON gpmd.gamePieceTypeId = gtypes4.Id AND gtypes4.type = \'media\' \
-            LEFT JOIN GamePieces AS gpi  ON r.releaseKey = gpi.releaseKey \
-                INNER JOIN GamePieceTypes gtypes5 ON gpi.gamePieceTypeId = gtypes5.Id AND gtypes5.type = \'originalImages\' \
-            LEFT JOIN GamePieces AS gpo  ON r.releaseKey = gpo.releaseKey \
-                INNER JOIN GamePieceTypes gtypes6 ON gpo.gamePieceTypeId = gtypes6.Id AND gtypes6.type = \'sortingTitle\' \
-            LEFT JOIN InstalledBaseProducts AS ig ON ig.productId = prk.gogId \
-            LEFT JOIN InstalledExternalProducts AS ie ON ie.id = prk.externalId \
-        WHERE isVisibleInLibrary = 1 AND isDlc = 0 AND u.isHidden = 0'
-
-    games = []
-    for row in c.execute(q):
-        game = Game(row)
-        
-        if ' demo' in game.title.lower() or \
-            ' beta' in game.title.lower() or \
-            ' test' in game.title.lower():
-            continue
-
-        games.append(game)
-    
-    conn.close()
-    return games
+    try:
+        for row in c.execute(GAMES_QUERY):
+            if users is not None and row['userId'] not in users:
+                continue
+            game = Game(row)
+            metrics.count('rows_decoded')
+
+            if ' demo' in game.title.lower() or \
+                ' beta' in game.title.lower() or \
+                ' test' in game.title.lower():
+                continue
+
+            yield game
+    finally:
+        conn.close()
+
+def connect_galaxy_db(db_path, snapshot = False):
+    """Opens the GOG db. With snapshot the live db is opened read-only and copied into
+    memory with the backup API, and the connection to the copy is returned. The live
+    db is then only locked for the copy, not while the rows are read and decoded,
+    so GalaxyClient is not blocked, and does not block us, during a sync.
+    """
+    if not snapshot:
+        return sqlite3.connect(db_path)
 
-def create_nfos(games, output_folder, overwrite_existing):
+    start = time.perf_counter()
+    live = sqlite3.connect(galaxy_db_uri(db_path), uri=True)
+    try:
+        conn = sqlite3.connect(':memory:')
+        live.backup(conn)
+    finally:
+        live.close()
+    logger.debug('Copied %s into memory in %.3f s', db_path, time.perf_counter() - start)
+    return conn
+
+def galaxy_db_uri(db_path):
+    # URI that opens the db read-only, it cannot take a write lock or create a journal.
+    return 'file:{}?mode=ro'.format(urllib.request.pathname2url(os.path.abspath(db_path)))
+
+def create_nfos(games, output_folder, overwrite_existing, workers = 1, manifest = None):
     nfo_folder = os.path.join(output_folder, 'games')
-    if not os.path.exists(nfo_folder):
-        os.makedirs(nfo_folder)
+    file_index.makedirs(nfo_folder)
+
+    if workers <= 1:
+        for game in games:
+            create_nfo(game, nfo_folder, overwrite_existing, manifest)
+        return
+
+    # Every NFO is an independent file, so rendering and writing them can be
+    # spread over a pool. Most of the time goes to waiting on the file system.
+    # Releases that share a file title share the NFO, they are written one after
+    # the other as in the serial loop.
+    releases = {}
     for game in games:
+        releases.setdefault(os.path.normcase(game.fileTitle), []).append(game)
 
-        doc_path = os.path.join(nfo_folder, '{}.nfo'.format(game.fileTitle))
-        if not overwrite_existing and os.path.exists(doc_path):
-            continue
+    def create_release_nfos(same_title):
+        for game in same_title:
+            create_nfo(game, nfo_folder, overwrite_existing, manifest)
 
-        gameXml = Element('game')
-        SubElement(gameXml, 'title').text = game.title
-        SubElement(gameXml, 'sorttitle').text = game.sortTitle
-        SubElement(gameXml, 'year').text = str(game.releaseDate.year) if game.releaseDate is not None else None
-        SubElement(gameXml, 'genre').text = ', '.join(game.genres) if game.genres else ''
-        SubElement(gameXml, 'developer').text = ', '.join(game.developers) if game.developers else ''
-        SubElement(gameXml, 'rating').text = str(int(game.score/10)) if game.score is not None else None
-        SubElement(gameXml, 'plot').text = game.summary
-        SubElement(gameXml, 'themes').text = ', '.join(game.themes) if game.themes else '' 
-        SubElement(gameXml, 'premiered').text = str(game.releaseDate)
-        SubElement(gameXml, 'platform').text = str(game.platform)
-        SubElement(gameXml, 'is_installed').text = str(game.is_installed)
-
-        if game.fanart is not None:
-            fanartXml = SubElement(gameXml, 'fanart')
-            SubElement(fanartXml, 'thumb').text = game.fanart
-        if game.cover is not None:
-            coverXml = SubElement(gameXml, 'cover')
-            SubElement(coverXml, 'thumb').text = game.cover
-        if game.icon is not None:
-            iconXml = SubElement(gameXml, 'icon')
-            SubElement(iconXml, 'thumb').text = game.icon
-
-        imagesXml = SubElement(gameXml, 'screenshots')
-        for snap in game.snaps:
-            SubElement(imagesXml, 'thumb').text = snap
-
-        if game.videos and len(game.videos) > 0:
-            SubElement(gameXml, 'trailer').text = str(game.videos[0].get_url())
-
-        videosXml = SubElement(gameXml, 'videos')
-        for video in game.videos:
-            SubElement(videosXml, 'video').text = video.get_url()
-            
-        xmldoc = prettify(gameXml)
-        try:
-            with open(doc_path, 'w', encoding='utf-8') as f:
-                f.write(xmldoc)
-        except OSError:
-            logger.error('(OSError) Cannot write {} file'.format(doc_path))
-        except IOError as e:
-            logger.error('(IOError) errno = {}'.format(e.errno))
-            if e.errno == errno.ENOENT: logger.error('(IOError) No such file or directory.')
-            logger.error('(IOError) Cannot write {} file'.format(doc_path))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='nfo') as pool:
+        for _ in pool.map(create_release_nfos, releases.values()):
+            pass
 
-        logger.debug('  Created NFO file for game {}'.format(game.title))
+def create_nfo(game, nfo_folder, overwrite_existing, manifest = None):
 
-def download_images(games, output_folder, overwrite_existing, folder_style):
-    if folder_style == 'AEL':
-        download_images_ael_style(games, output_folder, overwrite_existing)
+    doc_path = os.path.join(nfo_folder, '{}.nfo'.format(game.fileTitle))
+    if manifest is not None:
+        # The NFO of a game whose GamePieces changed since the last run is rendered again.
+        overwrite_existing = overwrite_existing or manifest.changed(game, SyncManifest.NFO)
+        manifest.record(game, SyncManifest.NFO, [doc_path])
+
+    if not overwrite_existing and file_index.exists(doc_path):
+        return
+
+    try:
+        with open(doc_path, 'w', encoding='utf-8') as f:
+            write_nfo(game, f)
+    except OSError:
+        logger.error('(OSError) Cannot write {} file'.format(doc_path))
+        if manifest is not None:
+            manifest.invalidate(game, SyncManifest.NFO)
+        return
+    except IOError as e:
+        logger.error('(IOError) errno = {}'.format(e.errno))
+        if e.errno == errno.ENOENT: logger.error('(IOError) No such file or directory.')
+        logger.error('(IOError) Cannot write {} file'.format(doc_path))
+        if manifest is not None:
+            manifest.invalidate(game, SyncManifest.NFO)
+        return
+
+    file_index.add(doc_path)
+    metrics.count('nfos_written')
+    logger.debug('  Created NFO file for game %s', game.title)
+
+def nfo_record(game):
+    """Returns the fields of the game's NFO, with the values as they are written.
+    Images and the trailer are None when the game has none.
+    """
+    return {
+        'title': game.title,
+        'sorttitle': game.sortTitle,
+        'year': str(game.releaseDate.year) if game.releaseDate is not None else None,
+        'genre': ', '.join(game.genres) if game.genres else '',
+        'developer': ', '.join(game.developers) if game.developers else '',
+        'rating': str(int(game.score/10)) if game.score is not None else None,
+        'plot': game.summary,
+        'themes': ', '.join(game.themes) if game.themes else '',
+        'premiered': str(game.releaseDate),
+        'platform': str(game.platform),
+        'is_installed': str(game.is_installed),
+        'fanart': game.fanart,
+        'cover': game.cover,
+        'icon': game.icon,
+        'screenshots': list(game.snaps),
+        'trailer': str(game.videos[0].get_url()) if game.videos else None,
+        'videos': [video.get_url() for video in game.videos]
+    }
+
+def write_nfo(game, f):
+    """Writes the <game> NFO document for the game to the file handle in one pass.
+    The output is the same as an ElementTree pretty-printed with minidom, which
+    is how the NFO files used to be made.
+    """
+    f.write('<?xml version="1.0" ?>\n')
+    write_nfo_game(f, 0, nfo_record(game))
+
+def write_nfo_game(f, level, record, attributes = ''):
+    indent = XML_INDENT * level
+    f.write('{}<game{}>\n'.format(indent, attributes))
+    for tag in NFO_TEXT_FIELDS:
+        write_xml_element(f, level + 1, tag, record[tag])
+    for tag in NFO_IMAGE_FIELDS:
+        if record[tag] is not None:
+            write_xml_list(f, level + 1, tag, 'thumb', [record[tag]])
+    write_xml_list(f, level + 1, 'screenshots', 'thumb', record['screenshots'])
+    if record['trailer'] is not None:
+        write_xml_element(f, level + 1, 'trailer', record['trailer'])
+    write_xml_list(f, level + 1, 'videos', 'video', record['videos'])
+    f.write('{}</game>\n'.format(indent))
+
+def write_ael_game(f, level, name, record, attributes = ''):
+    # The AEL fields first, see AEL_XML_FIELDS, then the rest of the NFO's.
+    indent = XML_INDENT * level
+    f.write('{}<game name="{}"{}>\n'.format(indent, xml_escape_text(name), attributes))
+    for tag, field in AEL_XML_FIELDS:
+        write_xml_element(f, level + 1, tag, record[field])
+    mapped = set(field for _, field in AEL_XML_FIELDS)
+    for tag in NFO_TEXT_FIELDS:
+        if tag not in mapped:
+            write_xml_element(f, level + 1, tag, record[tag])
+    for tag in NFO_IMAGE_FIELDS:
+        if record[tag] is not None:
+            write_xml_element(f, level + 1, tag, record[tag])
+    write_xml_list(f, level + 1, 'screenshots', 'thumb', record['screenshots'])
+    if record['trailer'] is not None:
+        write_xml_element(f, level + 1, 'trailer', record['trailer'])
+    write_xml_list(f, level + 1, 'videos', 'video', record['videos'])
+    f.write('{}</game>\n'.format(indent))
+
+def write_xml_element(f, level, tag, text):
+    indent = XML_INDENT * level
+    if text:
+        f.write('{}<{}>{}</{}>\n'.format(indent, tag, xml_escape_text(text), tag))
     else:
-        download_images_kodi_style(games, output_folder, overwrite_existing)
+        f.write('{}<{}/>\n'.format(indent, tag))
+
+def write_xml_list(f, level, tag, item_tag, texts):
+    indent = XML_INDENT * level
+    if not texts:
+        f.write('{}<{}/>\n'.format(indent, tag))
+        return
+
+    f.write('{}<{}>\n'.format(indent, tag))
+    for text in texts:
+        write_xml_element(f, level + 1, item_tag, text)
+    f.write('{}</{}>\n'.format(indent, tag))
+
+def xml_escape_text(text):
+    # Line endings are normalised as an XML parser would, characters that are
+    # not allowed in XML are dropped and the rest is escaped like minidom does.
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    text = XML_INVALID_CHARS.sub('', text)
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('"', '&quot;').replace('>', '&gt;')
+
+def export_catalog(games, output_folder, formats):
+    """Writes the NFO fields of all the games to one catalog file per format,
+    see CatalogExport, instead of a file per game.
+    """
+    exports = []
+    try:
+        for fmt in formats:
+            exports.append(CatalogExport(output_folder, fmt))
+        for game in games:
+            for export in exports:
+                export.write(game)
+    except Exception as ex:
+        logger.error('(Exception) Object type "{}"'.format(type(ex)))
+        logger.error('(Exception) Message "{}"'.format(str(ex)))
+        logger.error('Catalog export failed')
+        for export in exports:
+            export.close(False)
+        return
+
+    for export in exports:
+        export.close()
+
+def download_images(games, output_folder, overwrite_existing, folder_style, workers = DEFAULT_WORKERS, store = None, \
+        manifest = None):
+    downloader = ImageDownloader(workers, store)
+    try:
+        with downloader.hold():
+            if folder_style == 'AEL':
+                download_images_ael_style(games, output_folder, overwrite_existing, downloader, manifest)
+            else:
+                download_images_kodi_style(games, output_folder, overwrite_existing, downloader, manifest)
+    finally:
+        results = downloader.close()
+
+    log_download_results(results)
+    return results
+
+def download_images_ael_style(games, output_folder, overwrite_existing, downloader, manifest = None):
+
+    create_ael_folders(output_folder)
+    for game in games:
+        queue_images(game, ael_image_targets(game, output_folder), output_folder, overwrite_existing, downloader, manifest)
+
+def create_ael_folders(output_folder):
+
+    snaps_folder  = os.path.join(output_folder, 'snaps')
+    fanart_folder = os.path.join(output_folder, 'fanarts')
+    cover_folder  = os.path.join(output_folder, 'boxfronts')
+    icon_folder   = os.path.join(output_folder, 'icons')
+
+    file_index.makedirs(snaps_folder)
+    file_index.makedirs(fanart_folder)
+    file_index.makedirs(cover_folder)
+    file_index.makedirs(icon_folder)
 
-def download_images_ael_style(games, output_folder, overwrite_existing):   
+def ael_image_targets(game, output_folder):
+    # (kind, url, destination) of every image of the game, the cover first.
 
     snaps_folder  = os.path.join(output_folder, 'snaps')
     fanart_folder = os.path.join(output_folder, 'fanarts')
     cover_folder  = os.path.join(output_folder, 'boxfronts')
     icon_folder   = os.path.join(output_folder, 'icons')
 
-    if not os.path.exists(snaps_folder):
-        os.makedirs(snaps_folder)
-    if not os.path.exists(fanart_folder):
-        os.makedirs(fanart_folder)
-    if not os.path.exists(cover_folder):
-        os.makedirs(cover_folder)
-    if not os.path.exists(icon_folder):
-        os.makedirs(icon_folder)
+    file_name   = '{}.png'.format(game.fileTitle)
+    dest_icon   = os.path.join(icon_folder, file_name)
+    dest_fanart = os.path.join(fanart_folder, file_name)
+    dest_cover  = os.path.join(cover_folder, file_name)
+    dest_snap   = os.path.join(snaps_folder, file_name)
+
+    targets = [
+        ('cover', game.cover, dest_cover),
+        ('fanart', game.fanart, dest_fanart),
+        ('icon', game.icon, dest_icon)]
+    if len(game.snaps) > 0:
+        targets.append(('snap', game.snaps[0], dest_snap))
+    return targets
+
+def download_images_kodi_style(games, output_folder, overwrite_existing, downloader, manifest = None):
 
     for game in games:
+        queue_images(game, kodi_image_targets(game, output_folder), output_folder, overwrite_existing, downloader, manifest)
+
+def kodi_image_targets(game, output_folder):
+    # (kind, url, destination) of every image of the game, the cover first.
+
+    dest_icon   = os.path.join(output_folder, game.fileTitle, 'icon.png')
+    dest_fanart = os.path.join(output_folder, game.fileTitle, 'fanart.png')
+    dest_cover  = os.path.join(output_folder, game.fileTitle, '{}.tbn'.format(game.fileTitle))
+    dest_snap   = os.path.join(output_folder, game.fileTitle, 'snap.png')
+
+    targets = [
+        ('cover', game.cover, dest_cover),
+        ('fanart', game.fanart, dest_fanart),
+        ('icon', game.icon, dest_icon)]
+    if len(game.snaps) > 0:
+        targets.append(('snap#0', game.snaps[0], dest_snap))
+
+    if len(game.snaps) > 1:
+        i = 1
+        for snap in game.snaps[1:]:
+            snap_path = os.path.join(output_folder, game.fileTitle, 'extrasnaps', 'snap{}.png'.format(str(i)))
+            targets.append(('snap#{}'.format(i), snap, snap_path))
+            i = i + 1
+    return targets
+
+def image_targets(game, output_folder, folder_style):
+    if folder_style == 'AEL':
+        return ael_image_targets(game, output_folder)
+    return kodi_image_targets(game, output_folder)
 
-        file_name   = '{}.png'.format(game.fileTitle)
-        dest_icon   = os.path.join(icon_folder, file_name)
-        dest_fanart = os.path.join(fanart_folder, file_name)
-        dest_cover  = os.path.join(cover_folder, file_name)
-        dest_snap   = os.path.join(snaps_folder, file_name)
-    
-        if game.cover is not None and (not os.path.exists(dest_cover) or overwrite_existing):
-            net_download_img(game.cover, dest_cover)
-            logger.debug('  Downloaded cover image for game {}'.format(game.title))
-        if game.fanart is not None and (not os.path.exists(dest_fanart) or overwrite_existing):
-            net_download_img(game.fanart, dest_fanart)
-            logger.debug('  Downloaded fanart image for game {}'.format(game.title))
-        if game.icon is not None and (not os.path.exists(dest_icon) or overwrite_existing):
-            net_download_img(game.icon, dest_icon)
-            logger.debug('  Downloaded icon image for game {}'.format(game.title))
-        if len(game.snaps) > 0 and (not os.path.exists(dest_snap) or overwrite_existing):
-            net_download_img(game.snaps[0], dest_snap)
-            logger.debug('  Downloaded snap image for game {}'.format(game.title))
-
-def download_images_kodi_style(games, output_folder, overwrite_existing):   
-    
+def image_priority(game, kind):
+    # Lower is downloaded first: by kind, see IMAGE_PRIORITIES, then installed games first.
+    return IMAGE_PRIORITIES.get(kind, IMAGE_PRIORITY_EXTRA), 0 if game.is_installed else 1
+
+def queue_images(game, targets, output_folder, overwrite_existing, downloader, manifest = None):
+    """Queues the images of the game on the downloader and returns their futures, the cover's
+    first, None for a missing image.
+    Images of a game whose GamePieces changed since the last run are downloaded again.
+    """
+    changed = False
+    if manifest is not None:
+        changed = manifest.changed(game, SyncManifest.IMAGES)
+        overwrite_existing = overwrite_existing or changed
+        manifest.record(game, SyncManifest.IMAGES, [path for _, url, path in targets if url is not None])
+
+    futures = [downloader.submit(game, kind, url, path, overwrite_existing) for kind, url, path in targets]
+    if changed:
+        # The fingerprint is recorded before the downloads. Images that failed, or were deferred
+        # or cancelled, are missing or stale. Missing ones are downloaded by any later run, stale
+        # ones only when the game still counts as changed.
+        def not_downloaded(future):
+            if DownloadResult.missing(future):
+                manifest.invalidate(game, SyncManifest.IMAGES)
+        for future in futures:
+            if future is not None:
+                future.add_done_callback(not_downloaded)
+    return futures
+
+def log_download_results(results):
+    # Results are logged in submission order, regardless of the order in which
+    # the workers finished, so two runs over the same library give the same log.
+    counts = {DownloadResult.OK: 0, DownloadResult.SKIPPED: 0, DownloadResult.FAILED: 0, DownloadResult.DEFERRED: 0}
+    for result in results:
+        counts[result.status] += 1
+        if result.status == DownloadResult.OK:
+            logger.debug('  Downloaded %s image for game %s', result.kind, result.title)
+        elif result.status == DownloadResult.FAILED:
+            logger.error('(Exception) Downloading {} image for game {} from {}'.format(result.kind, result.title, result.url))
+            logger.error('(Exception) Object type "{}"'.format(type(result.error)))
+            logger.error('(Exception) Message "{0}"'.format(str(result.error)))
+
+    metrics.count('images_fetched', counts[DownloadResult.OK])
+    metrics.count('images_skipped', counts[DownloadResult.SKIPPED])
+    metrics.count('images_failed', counts[DownloadResult.FAILED])
+    metrics.count('images_deferred', counts[DownloadResult.DEFERRED])
+    logger.info('Images: {} downloaded, {} skipped, {} failed'.format(
+        counts[DownloadResult.OK], counts[DownloadResult.SKIPPED], counts[DownloadResult.FAILED]))
+    if counts[DownloadResult.DEFERRED]:
+        logger.info('Images: {} deferred to the next run, the time budget is used up'.format(counts[DownloadResult.DEFERRED]))
+
+def create_lnks(games, output_folder, overwrite_existing, client_path = GALAXY_CLIENT_PATH):
+
+    lnk_folder = os.path.join(output_folder, 'games')
+    file_index.makedirs(lnk_folder)
     for game in games:
+        create_lnk(game, lnk_folder, client_path, overwrite_existing)
 
-        dest_icon   = os.path.join(output_folder, game.fileTitle, 'icon.png')
-        dest_fanart = os.path.join(output_folder, game.fileTitle, 'fanart.png')
-        dest_cover  = os.path.join(output_folder, game.fileTitle, '{}.tbn'.format(game.fileTitle))
-        dest_snap   = os.path.join(output_folder, game.fileTitle, 'snap.png')
-    
-        if game.cover is not None and (not os.path.exists(dest_cover) or overwrite_existing):
-            net_download_img(game.cover, dest_cover)
-            logger.debug('  Downloaded cover image for game {}'.format(game.title))
-        if game.fanart is not None and (not os.path.exists(dest_fanart) or overwrite_existing):
-            net_download_img(game.fanart, dest_fanart)
-            logger.debug('  Downloaded fanart image for game {}'.format(game.title))
-        if game.icon is not None and (not os.path.exists(dest_icon) or overwrite_existing):
-            net_download_img(game.icon, dest_icon)
-            logger.debug('  Downloaded icon image for game {}'.format(game.title))
-        if len(game.snaps) > 0 and (not os.path.exists(dest_snap) or overwrite_existing):
-            net_download_img(game.snaps[0], dest_snap)
-            logger.debug('  Downloaded snap#0 image for game {}'.format(game.title))
-
-        if len(game.snaps) > 1:
-            i = 1
-            for snap in game.snaps[1:]:
-                snap_path = os.path.join(output_folder, game.fileTitle, 'extrasnaps', 'snap{}.png'.format(str(i)))
-                if not os.path.exists(snap_path) or overwrite_existing:
-                    net_download_img(snap, snap_path)
-                    logger.debug('  Downloaded snap#{} image for game {}'.format(i, game.title))
-                i = i + 1
-
-def create_lnks(games, output_folder, overwrite_existing):
-    
-    if not os.name == 'nt':
+def create_lnk(game, lnk_folder, client_path, overwrite_existing):
+
+    game_path = os.path.join(lnk_folder, '{}.lnk'.format(game.fileTitle))
+    if not overwrite_existing and file_index.exists(game_path):
         return
 
-    dir_path = os.path.dirname(os.path.realpath(__file__))
-    ps_path = os.path.join(dir_path, 'shortcuts.ps1')
+    try:
+        write_lnk(game_path, client_path, '/command=runGame /gameId={}'.format(game.id))
+    except OSError as ex:
+        logger.error('(OSError) Cannot write {} file'.format(game_path))
+        logger.error('(OSError) Message "{0}"'.format(str(ex)))
+        return
 
-    lnk_folder = os.path.join(output_folder, 'games')
+    file_index.add(game_path)
+    metrics.count('lnks_written')
+    logger.debug('  Created shortcut for game %s at %s', game.title, game_path)
+
+def write_lnk(lnk_path, target_path, arguments):
+    with open(lnk_path, 'wb') as f:
+        f.write(lnk_bytes(target_path, arguments))
+
+def lnk_bytes(target_path, arguments):
+    """Returns a Windows shortcut (MS-SHLLINK) to the absolute Windows path target_path,
+    started with the given arguments. Same target and arguments as WScript.Shell
+    would write, without timestamps so the same input always gives the same bytes.
+    """
+    flags = LNK_HAS_TARGET_ID_LIST | LNK_HAS_LINK_INFO | LNK_HAS_ARGUMENTS | LNK_IS_UNICODE
+    header = struct.pack('<I16sII8s8s8sIiIH2sII',
+        0x4C, LNK_CLSID, flags, LNK_FILE_ATTRIBUTE_ARCHIVE,
+        bytes(8), bytes(8), bytes(8), 0, 0, LNK_SW_SHOWNORMAL, 0, bytes(2), 0, 0)
+
+    args = arguments.encode('utf-16-le')
+    string_data = struct.pack('<H', len(args) // 2) + args
+
+    return header + lnk_id_list(target_path) + lnk_link_info(target_path) + string_data + bytes(4)
+
+def lnk_id_list(target_path):
+    # My Computer -> drive -> one item per folder -> the file itself
+    drive, path = ntpath.splitdrive(target_path)
+    parts = [part for part in path.split('\\') if part]
+
+    items = [LNK_MY_COMPUTER_ITEM]
+    items.append(b'\x2F' + (drive + '\\').encode('ascii').ljust(22, b'\x00'))
+    for idx, part in enumerate(parts):
+        is_file = idx == len(parts) - 1
+        name = part.encode(LNK_ANSI_ENCODING, 'replace') + b'\x00'
+        if len(name) % 2:
+            name += b'\x00'
+        items.append(struct.pack('<BBIIH',
+            0x32 if is_file else 0x31, 0, 0, 0,
+            LNK_FILE_ATTRIBUTE_ARCHIVE if is_file else LNK_FILE_ATTRIBUTE_DIRECTORY) + name)
+
+    id_list = b''.join(struct.pack('<H', len(item) + 2) + item for item in items) + bytes(2)
+    return struct.pack('<H', len(id_list)) + id_list
+
+def lnk_link_info(target_path):
+    volume_id = struct.pack('<IIII', 0x11, LNK_DRIVE_FIXED, 0, 0x10) + b'\x00'
+    base_path = target_path.encode(LNK_ANSI_ENCODING, 'replace') + b'\x00'
+    base_path_unicode = target_path.encode('utf-16-le') + bytes(2)
+
+    header_size = 0x24
+    volume_id_offset = header_size
+    base_path_offset = volume_id_offset + len(volume_id)
+    suffix_offset = base_path_offset + len(base_path)
+    base_path_unicode_offset = suffix_offset + 1
+    suffix_unicode_offset = base_path_unicode_offset + len(base_path_unicode)
+    size = suffix_unicode_offset + 2
+
+    return struct.pack('<IIIIIIIII', size, header_size, LNK_VOLUME_ID_AND_LOCAL_BASE_PATH,
+            volume_id_offset, base_path_offset, 0, suffix_offset,
+            base_path_unicode_offset, suffix_unicode_offset) + \
+        volume_id + base_path + b'\x00' + base_path_unicode + bytes(2)
+
+def add_games_to_shield(games, recognized_games, output_folder, shield_folder, overwrite_existing, library = None):
+    """Mirrors the lnk and box-art of the games into the Shield Apps folder in one pass,
+    then removes the Shield entries of the games no longer in library, the games by default.
+    """
+    mirror = ShieldMirror(output_folder, shield_folder)
     for game in games:
+        add_game_to_shield(game, recognized_games, output_folder, mirror, overwrite_existing)
+    sweep_shield(mirror, recognized_games, library if library is not None else games)
+
+def sweep_shield(mirror, recognized_games, library):
+    # Removes the Shield entries of the games not in library and saves the mirror.
+    for game in library:
+        mirror.keep(game.fileTitle)
+    mirror.sweep()
+    mirror.save()
+
+    recognized_games.log_matches()
+
+def add_game_to_shield(game, recognized_games, output_folder, mirror, overwrite_existing):
 
-        game_path = os.path.join(lnk_folder, '{}.lnk'.format(game.fileTitle))
-        if not overwrite_existing and os.path.exists(game_path):
-            continue
-        
-        cmd = [ 
-            "PowerShell", 
-            "-ExecutionPolicy",
-             "Unrestricted", 
-             "-File", 
-             ps_path,
-             "E:\\Software\\GOG Galaxy\\GalaxyClient.exe", 
-             "/command=runGame /gameId={}".format(game.id),
-              game_path]
-        #print(' CMD={}'.format(cmd))
-        ec = subprocess.call(cmd)
-        logger.debug('  Powershell returned: {0:d}'.format(ec))
-        logger.debug('  Created shortcut for game {} at {}'.format(game.title, game_path))
-
-def add_games_to_shield(games, recognized_games, output_folder, shield_folder, overwrite_existing):
-    
     lnk_folder = os.path.join(output_folder, 'games')
     img_folder = os.path.join(output_folder, 'boxfronts')
-    for game in games:
 
-        img_path = os.path.join(img_folder, '{}.png'.format(game.fileTitle))
-        game_path = os.path.join(lnk_folder, '{}.lnk'.format(game.fileTitle))
+    img_path = os.path.join(img_folder, '{}.png'.format(game.fileTitle))
+    game_path = os.path.join(lnk_folder, '{}.lnk'.format(game.fileTitle))
 
-        shield_lnk = os.path.join(shield_folder,'{}.lnk'.format(game.fileTitle))
-        shield_img_folder = os.path.join(shield_folder, 'StreamingAssets', game.fileTitle) 
-        shield_img = os.path.join(shield_img_folder, 'box-art.png')
+    shield_lnk = os.path.join(mirror.shield_folder, '{}.lnk'.format(game.fileTitle))
+    shield_img = os.path.join(mirror.shield_folder, 'StreamingAssets', game.fileTitle, 'box-art.png')
 
-        if game in recognized_games:
-            logger.warn('  Game {} already recognized. Skipping'.format(game.title))
-            if os.path.exists(shield_lnk):
-                logger.warn('  Removing lnk file for game {} from Shield'.format(game.title))
-                os.remove(shield_lnk)
-            continue
+    recognized, rule = recognized_games.match(game)
+    if recognized is not None:
+        logger.warn('  Game {} already recognized as {} ({} match). Skipping'.format(game.title, recognized.title, rule))
+        if file_index.exists(shield_lnk):
+            logger.warn('  Removing lnk file for game {} from Shield'.format(game.title))
+        mirror.drop(game.fileTitle, [shield_lnk])
+        return
 
-        if not os.path.exists(game_path):
-            logger.debug(' {} not found, skipping'.format(game_path))
-            continue
-        
-        if not overwrite_existing and os.path.exists(shield_lnk):
-            continue
+    if not file_index.exists(game_path):
+        logger.debug(' %s not found, skipping', game_path)
+        return
 
-        try:
-            if not os.path.exists(shield_img):
-                os.makedirs(shield_img_folder)
-
-            logger.debug('Copying lnk file for {} to {}'.format(game.fileTitle, shield_lnk))
-            copyfile(game_path, shield_lnk)
-            logger.debug('Copying boxart for {} to {}'.format(game.fileTitle, shield_img))
-            
-            copyfile(img_path, shield_img)
-        except Exception as ex:
-            logger.error('(Exception) Object type "{}"'.format(type(ex)))
-            logger.error('(Exception) Message "{0}"'.format(str(ex)))
+    try:
+        mirror.mirror(game.fileTitle, [(game_path, shield_lnk), (img_path, shield_img)], overwrite_existing)
+    except Exception as ex:
+        logger.error('(Exception) Object type "{}"'.format(type(ex)))
+        logger.error('(Exception) Message "{0}"'.format(str(ex)))
+        return False
     
 def load_games_from_geforce(shield_folder):
+    """Reads the games GeForce Experience recognized from its journal, the children of
+    the <Application> elements. The journal is parsed incrementally and every element
+    is dropped once it has been read, so memory does not grow with the journal.
+    """
     db_file = os.path.join(shield_folder, 'journalBS.main.xml')
-    xml_data = None 
-    
+    games = RecognizedGames()
+    count = 0
+
+    # The open elements, from the root down to the one being parsed, and the
+    # depth of the <Application> element the parser is in.
+    stack = []
+    application = None
     try:
-        xml_data = ET.parse(db_file)
+        for event, elem in ET.iterparse(db_file, events=('start', 'end')):
+            if event == 'start':
+                if application is None and elem.tag == 'Application':
+                    application = len(stack)
+                stack.append(elem)
+                continue
+
+            stack.pop()
+            depth = len(stack)
+            if depth == 0:
+                break
+            if application is not None and depth > application:
+                if depth == application + 1:
+                    count += 1
+                    add_geforce_game(games, elem)
+                    stack[-1].remove(elem)
+                continue
+            if depth == application:
+                application = None
+            # Not part of a game entry, nothing else is read from the journal.
+            stack[-1].remove(elem)
     except OSError:
         logger.error('(OSError) Cannot read {} file'.format(db_file))
-    except IOError as e:
-        logger.error('(IOError) errno = {}'.format(e.errno))
-        if e.errno == errno.ENOENT: logger.error('(IOError) No such file or directory.')
-        logger.error('(IOError) Cannot read {} file'.format(db_file))
-        
-    if xml_data is None:
-        return []
-
-    games = []
-    
-    game_nodes =  xml_data.findall('.//Application/*')
-    logger.info('Nvidia has {} games recognized'.format(len(game_nodes)))
-
-    for game_xml in game_nodes:
-        
-        title_node = game_xml.find('DisplayName')
-        sort_title_node = game_xml.find('ShortName')
-        stream_supported_node = game_xml.find('IsStreamingSupported')
-
-        logger.debug('  Found Nvidia recognized game: {}'.format(title_node.text))
-        if stream_supported_node.text == '0':
-            logger.debug('  [SKIP] Streaming not supported. Skipping: {}'.format(title_node.text))
-            continue
-
-        game = Game(None)
-        game.title = title_node.text
-        game.sortTitle = sort_title_node.text.replace('_', ' ')
-        game.fileTitle = sort_title_node.text.replace('_', ' ')
-        logger.debug('  [ADD] Streaming supported. Adding: {}'.format(title_node.text))
-        games.append(game)
+        return games
+    except ET.ParseError as ex:
+        logger.error('(ParseError) Cannot parse {} file'.format(db_file))
+        logger.error('(ParseError) Message "{0}"'.format(str(ex)))
 
+    logger.info('Nvidia has {} games recognized'.format(count))
     return games
 
-def prettify(elem):
-    """Return a pretty-printed XML string for the Element.
-    """
-    rough_string = ET.tostring(elem, 'utf-8')
-    reparsed = minidom.parseString(rough_string)
-    return reparsed.toprettyxml(indent="  ")
-
-def net_download_img(img_url, file_path):
-    # --- Download image to a buffer in memory ---
-    # If an exception happens here no file is created (avoid creating files with 0 bytes).
-    try:
-        req = urllib.request.Request(img_url)
-        # req.add_unredirected_header('User-Agent', net_get_random_UserAgent())
-        req.add_unredirected_header('User-Agent', USER_AGENT)
-        img_buf = urllib.request.urlopen(req, timeout = 120).read()
-    except IOError as ex:
-        logger.error('(IOError) Object type "{}"'.format(type(ex)))
-        logger.error('(IOError) Message "{0}"'.format(str(ex)))
+def add_geforce_game(games, game_xml):
+    # Adds a game entry of the GeForce journal, unless it cannot be streamed.
+    title = game_xml.findtext('DisplayName') or ''
+    short_name = game_xml.findtext('ShortName') or ''
+    if not title and not short_name:
+        logger.debug('  [SKIP] No DisplayName or ShortName in %s', game_xml.tag)
         return
-    except Exception as ex:
-        logger.error('(Exception) Object type "{}"'.format(type(ex)))
-        logger.error('(Exception) Message "{0}"'.format(str(ex)))
+    title = title or short_name.replace('_', ' ')
+    short_name = short_name or title
+
+    logger.debug('  Found Nvidia recognized game: %s', title)
+    if game_xml.findtext('IsStreamingSupported') == '0':
+        logger.debug('  [SKIP] Streaming not supported. Skipping: %s', title)
         return
 
+    game = Game(None)
+    game.title = title
+    game.sortTitle = short_name.replace('_', ' ')
+    game.fileTitle = short_name.replace('_', ' ')
+    logger.debug('  [ADD] Streaming supported. Adding: %s', title)
+    games.add(game)
+
+def net_download_img(img_url, file_path, connections = None, validators = None):
+    """Downloads the image, see net_download_img_once, within the in-flight limit of its
+    host. Throttled, failing and timed out requests are retried with a jittered
+    exponential backoff, or after the Retry-After delay the server asks for.
+    """
+    if connections is None:
+        connections = {}
+    host = rate_control.host(img_url)
+    for attempt in range(NET_RETRIES + 1):
+        started = host.acquire()
+        ok = False
+        try:
+            validators = net_download_img_once(img_url, file_path, connections, validators)
+            ok = True
+            return validators
+        except HttpStatusError as ex:
+            if not ex.retryable() or attempt == NET_RETRIES:
+                raise
+            retry_after = ex.retry_after
+            delay = retry_after if retry_after is not None else net_backoff(attempt)
+            reason = 'HTTP {}'.format(ex.status)
+        except (TimeoutError, ConnectionError, http.client.HTTPException) as ex:
+            net_close(connections, img_url)
+            if attempt == NET_RETRIES:
+                raise
+            retry_after = None
+            delay = net_backoff(attempt)
+            reason = type(ex).__name__
+        finally:
+            host.release(ok)
+
+        # Retry-After holds back every request to the host, a backoff only this one.
+        host.backoff(started, retry_after)
+        logger.debug('  %s for %s, retrying in %.1f s', reason, img_url, delay)
+        if retry_after is None:
+            time.sleep(delay)
+
+def net_download_img_once(img_url, file_path, connections = None, validators = None):
+    # --- Download image in chunks to a temporary file next to the destination ---
+    # The image is only renamed into place once it is complete, so no partial or 0 byte
+    # images end up in the output folders. An interrupted download leaves the .part file
+    # behind and the next attempt resumes it with a Range request.
+    # Errors are raised to the caller, which records them as a failed download.
+    # Connections are kept alive in the given dict, one per (scheme, host).
+    # Returns the validators of the image (see net_validators). When the validators of an
+    # earlier download are given the request is conditional, and None is returned when
+    # the server answers 304 Not Modified; file_path is left untouched then.
+    if connections is None:
+        connections = {}
+
+    folder = os.path.dirname(file_path)
+    if folder:
+        file_index.makedirs(folder)
+
+    temp_path = file_path + NET_PART_SUFFIX
+    offset = os.path.getsize(temp_path) if file_index.exists(temp_path) else 0
+
+    url = img_url
+    for _ in range(NET_MAX_REDIRECTS + 1):
+        headers = {}
+        if offset > 0:
+            headers['Range'] = 'bytes={}-'.format(offset)
+        elif validators:
+            if validators.get('etag'):
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('modified'):
+                headers['If-Modified-Since'] = validators['modified']
+        response = net_open(connections, url, headers)
+        status = response.status
+
+        if status in (301, 302, 303, 307, 308) and response.getheader('Location'):
+            net_finish(connections, url, response)
+            url = urljoin(url, response.getheader('Location'))
+            continue
+        if status == 304 and offset == 0 and validators:
+            net_finish(connections, url, response)
+            return None
+        if status == 416 and offset > 0:
+            # The part file does not fit the image on the server anymore, start over.
+            net_finish(connections, url, response)
+            os.remove(temp_path)
+            file_index.discard(temp_path)
+            offset = 0
+            continue
+        if status == 206 and offset > 0 and net_range_start(response) == offset:
+            mode = 'ab'
+        elif status == 200:
+            mode = 'wb'
+            offset = 0
+        else:
+            net_finish(connections, url, response)
+            raise HttpStatusError(status, url, net_retry_after(response))
+        break
+    else:
+        raise IOError('Too many redirects for {}'.format(img_url))
+
     # --- Write image file to disk ---
-    # There should be no more 0 size files with this code.
     try:
-        with open(file_path, 'wb') as f:
-            f.write(img_buf)
-    except IOError as ex:
-        logger.error('(IOError) In net_download_img(), disk code.')
-        logger.error('(IOError) Object type "{}"'.format(type(ex)))
-        logger.error('(IOError) Message "{0}"'.format(str(ex)))
-    except Exception as ex:
-        logger.error('(Exception) In net_download_img(), disk code.')
-        logger.error('(net_download_img) Object type "{}"'.format(type(ex)))
-        logger.error('(Exception) Message "{0}"'.format(str(ex)))
+        with open(temp_path, mode) as f:
+            while True:
+                chunk = response.read(NET_CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+                metrics.count('bytes_transferred', len(chunk))
+    except Exception:
+        net_close(connections, url)
+        # Indexed, so the retry finds the part file and resumes it.
+        file_index.add(temp_path)
+        raise
+    net_finish(connections, url, response)
+
+    expected = response.getheader('Content-Length')
+    if expected is not None and os.path.getsize(temp_path) != offset + int(expected):
+        file_index.add(temp_path)
+        raise ConnectionError('Incomplete download of {}'.format(img_url))
+
+    os.replace(temp_path, file_path)
+    file_index.discard(temp_path)
+    file_index.add(file_path)
+    return net_validators(response, os.path.getsize(file_path))
+
+def net_validators(response, length):
+    # The cache validators of a downloaded image: its ETag, Last-Modified date and length.
+    validators = { 'length': length }
+    if response.getheader('ETag'):
+        validators['etag'] = response.getheader('ETag')
+    if response.getheader('Last-Modified'):
+        validators['modified'] = response.getheader('Last-Modified')
+    return validators
+
+def net_backoff(attempt):
+    # Full jitter, so throttled workers do not all come back at the same moment.
+    return random.uniform(0, min(NET_BACKOFF_MAX, NET_BACKOFF_BASE * 2 ** attempt))
+
+def net_retry_after(response):
+    # Retry-After: <seconds> or Retry-After: <HTTP date>
+    value = response.getheader('Retry-After')
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            return None
+    return min(max(0.0, seconds), NET_RETRY_AFTER_MAX)
+
+def net_range_start(response):
+    # Content-Range: bytes <start>-<end>/<size>
+    content_range = response.getheader('Content-Range', '')
+    try:
+        return int(content_range.split(' ', 1)[1].split('-', 1)[0])
+    except (IndexError, ValueError):
+        return None
+
+def net_open(connections, url, headers = None):
+    """Sends a GET request for url over the kept alive connection for its host and
+    returns the response. The caller must read the response to the end and then
+    call net_finish(), or net_close() when it gives up on the response.
+    """
+    parts = urlsplit(url)
+    key = (parts.scheme, parts.netloc)
+    path = parts.path or '/'
+    if parts.query:
+        path = '{}?{}'.format(path, parts.query)
+    request_headers = { 'User-Agent': USER_AGENT }
+    if headers:
+        request_headers.update(headers)
+
+    # A kept alive connection may have been closed by the server in the meantime,
+    # in that case reconnect once and retry the request.
+    for attempt in range(2):
+        conn = connections.get(key)
+        if conn is None:
+            if parts.scheme == 'https':
+                conn = http.client.HTTPSConnection(parts.netloc, timeout = NET_TIMEOUT)
+            else:
+                conn = http.client.HTTPConnection(parts.netloc, timeout = NET_TIMEOUT)
+            connections[key] = conn
+        try:
+            start = time.perf_counter()
+            conn.request('GET', path, headers = request_headers)
+            response = conn.getresponse()
+            metrics.observe_request(time.perf_counter() - start)
+            return response
+        except (http.client.RemoteDisconnected, http.client.CannotSendRequest, ConnectionResetError, BrokenPipeError):
+            net_close(connections, url)
+            if attempt > 0:
+                raise
+
+def net_finish(connections, url, response):
+    # Drains what is left of the response so the connection can be used again.
+    response.read()
+    if response.will_close:
+        net_close(connections, url)
+
+def net_close(connections, url):
+    parts = urlsplit(url)
+    conn = connections.pop((parts.scheme, parts.netloc), None)
+    if conn is not None:
+        conn.close()
+
+def file_digest(file_path):
+    # Returns the sha256 hex digest and size of the file.
+    digest = hashlib.sha256()
+    size = 0
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(NET_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+def fingerprint(*values):
+    digest = hashlib.sha1()
+    for value in values:
+        digest.update(str(value).encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.hexdigest()
 
 def dict_factory(cursor, row):
     d = {}
@@ -520,57 +1692,200 @@ def text_str_to_filename_str(title_str):
     return cleaned_str_2
 
 class Game(object):
+    """A release from the GOG db. The GamePieces are kept as the raw JSON strings
+    from the row and only decoded, once, when a field is first read. After
+    decoding only the fields used are kept and the JSON string is released.
+    """
+
+    __slots__ = ('id', 'game_id', 'user_id', 'is_installed', 'platform', '_fingerprints',
+        '_title_json', '_sort_json', '_summary_json', '_meta_json', '_media_json', '_images_json',
+        '_title', '_fileTitle', '_sortTitle', '_summary', '_meta', '_images', '_snaps', '_videos')
+
+    META_FIELDS = ('criticsScore', 'developers', 'genres', 'themes', 'publishers', 'releaseDate')
 
     def __init__(self, data_row):
-        
+
+        self.id = None
+        self.game_id = None
+        self.user_id = None
+        self.is_installed = None
+        self.platform = None
+        self._fingerprints = {}
+
+        self._title_json = None
+        self._sort_json = None
+        self._summary_json = None
+        self._meta_json = None
+        self._media_json = None
+        self._images_json = None
+
+        self._title = _UNSET
+        self._fileTitle = _UNSET
+        self._sortTitle = _UNSET
+        self._summary = _UNSET
+        self._meta = _UNSET
+        self._images = _UNSET
+        self._snaps = _UNSET
+        self._videos = _UNSET
+
         if data_row is None:
-            return 
+            return
 
         self.id = data_row['releaseKey']
         self.game_id = data_row['gameId']
-        
-        self.title = json.loads(data_row['title'])['title'] if data_row['title'] else 'Unknown'
-        self.fileTitle = text_str_to_filename_str(self.title)
-        self.sortTitle = json.loads(data_row['sort'])['title'] if data_row['sort'] else self.title
-        self.summary = json.loads(data_row['summary'])['summary'] if data_row['summary'] else ''
-
+        self.user_id = data_row.get('userId')
         self.is_installed = data_row['Installed']
         self.platform = data_row['platform']
 
-        meta_data = json.loads(data_row['meta']) if data_row['meta'] else None
-        media = json.loads(data_row['media']) if data_row['media'] else None
-        images = json.loads(data_row['images']) if data_row['images'] else None
-
-        self.score = meta_data['criticsScore'] if meta_data and 'criticsScore' in meta_data else None
-        self.developers = meta_data['developers'] if meta_data and 'developers' in meta_data else None 
-        self.genres = meta_data['genres'] if meta_data and 'genres' in meta_data else None
-        self.themes = meta_data['themes'] if meta_data and 'themes' in meta_data else None
-        self.publishers = meta_data['publishers'] if meta_data and 'publishers' in meta_data else None
-        self.releaseDateTimestamp = meta_data['releaseDate'] if meta_data and 'releaseDate' in meta_data else None
-
-        if self.releaseDateTimestamp is not None:
-            self.releaseDate = datetime.utcfromtimestamp(self.releaseDateTimestamp) 
-        else: self.releaseDate = None
-
-        self.fanart = images['background'].replace('\\','').replace('.webp', '.png') if images['background'] is not None else None
-        self.icon   = images['squareIcon'].replace('\\','').replace('.webp', '.png') if images['squareIcon'] is not None else None
-        self.cover  = images['verticalCover'].replace('\\','').replace('.webp', '.png') if images['verticalCover'] is not None else None
-        self.snaps = []
+        self._title_json = data_row['title']
+        self._sort_json = data_row['sort']
+        self._summary_json = data_row['summary']
+        self._meta_json = data_row['meta']
+        self._media_json = data_row['media']
+        self._images_json = data_row['images']
+
+        # The NFO is made from all pieces, the images only from media and images.
+        self._fingerprints = {
+            SyncManifest.NFO: fingerprint(data_row['title'], data_row['sort'], data_row['summary'], data_row['meta'],
+                data_row['media'], data_row['images'], self.platform, self.is_installed),
+            SyncManifest.IMAGES: fingerprint(data_row['media'], data_row['images'])
+        }
+
+    def fingerprint(self, stage):
+        """Returns the fingerprint of the GamePieces the artifacts of the given stage are made from.
+        """
+        return self._fingerprints.get(stage)
+
+    @property
+    def title(self):
+        if self._title is _UNSET:
+            self._title = json_loads(self._title_json)['title'] if self._title_json else 'Unknown'
+            self._title_json = None
+        return self._title
+
+    @title.setter
+    def title(self, value):
+        self._title = value
+
+    @property
+    def fileTitle(self):
+        if self._fileTitle is _UNSET:
+            file_title = text_str_to_filename_str(self.title)
+            # hack
+            if '10Wing' in file_title:
+                file_title = file_title.replace('10Wing', 'XWing')
+            self._fileTitle = file_title
+        return self._fileTitle
+
+    @fileTitle.setter
+    def fileTitle(self, value):
+        self._fileTitle = value
+
+    @property
+    def sortTitle(self):
+        if self._sortTitle is _UNSET:
+            self._sortTitle = json_loads(self._sort_json)['title'] if self._sort_json else self.title
+            self._sort_json = None
+        return self._sortTitle
+
+    @sortTitle.setter
+    def sortTitle(self, value):
+        self._sortTitle = value
+
+    @property
+    def summary(self):
+        if self._summary is _UNSET:
+            self._summary = json_loads(self._summary_json)['summary'] if self._summary_json else ''
+            self._summary_json = None
+        return self._summary
+
+    @property
+    def score(self):
+        return self._meta_value('criticsScore')
+
+    @property
+    def developers(self):
+        return self._meta_value('developers')
+
+    @property
+    def genres(self):
+        return self._meta_value('genres')
+
+    @property
+    def themes(self):
+        return self._meta_value('themes')
+
+    @property
+    def publishers(self):
+        return self._meta_value('publishers')
+
+    @property
+    def releaseDateTimestamp(self):
+        return self._meta_value('releaseDate')
+
+    @property
+    def releaseDate(self):
+        timestamp = self.releaseDateTimestamp
+        return datetime.utcfromtimestamp(timestamp) if timestamp is not None else None
+
+    @property
+    def fanart(self):
+        return self._decode_images()[0]
+
+    @property
+    def icon(self):
+        return self._decode_images()[1]
+
+    @property
+    def cover(self):
+        return self._decode_images()[2]
+
+    @property
+    def snaps(self):
+        if self._snaps is _UNSET:
+            self._decode_media()
+        return self._snaps
+
+    @property
+    def videos(self):
+        if self._videos is _UNSET:
+            self._decode_media()
+        return self._videos
+
+    def _meta_value(self, key):
+        if self._meta is _UNSET:
+            meta_data = json_loads(self._meta_json) if self._meta_json else None
+            self._meta = { field: meta_data[field] for field in Game.META_FIELDS if field in meta_data } \
+                if meta_data else None
+            self._meta_json = None
+        return self._meta[key] if self._meta and key in self._meta else None
+
+    def _decode_images(self):
+        if self._images is _UNSET:
+            images = json_loads(self._images_json) if self._images_json else {}
+            self._images = tuple(
+                images[key].replace('\\','').replace('.webp', '.png') if images.get(key) is not None else None
+                for key in ('background', 'squareIcon', 'verticalCover'))
+            self._images_json = None
+        return self._images
+
+    def _decode_media(self):
+        media = json_loads(self._media_json) if self._media_json else None
+
+        self._snaps = []
         if media and 'screenshots' in media:
             for img in media['screenshots']:
-                self.snaps.append(img
+                self._snaps.append(img
                     .replace('\\','')
                     .replace('{formatter}', '')
                     .replace('{ext}', 'png'))
 
-        self.videos = []
+        self._videos = []
         if media and 'videos' in media:
             for videoMedia in media['videos']:
-                self.videos.append(Video(videoMedia))
-        
-        # hack
-        if '10Wing' in self.fileTitle:
-            self.fileTitle = self.fileTitle.replace('10Wing', 'XWing')
+                self._videos.append(Video(videoMedia))
+
+        self._media_json = None
 
     def __eq__(self, other):
         if self.sortTitle.lower() == other.sortTitle.lower():
@@ -582,6 +1897,8 @@ class Game(object):
 
 class Video(object):
 
+    __slots__ = ('name', 'provider', 'videoId')
+
     def __init__(self, video_data):
         self.name = video_data['name']
         self.provider = video_data['provider']
@@ -593,5 +1910,1320 @@ class Video(object):
 
         return self.videoId
 
+class RecognizedGames(object):
+    """The games GeForce Experience already recognizes, indexed on their
+    normalised sort title so matching a game is a dict lookup instead of a
+    comparison against every recognized game. Matches the same games as
+    Game.__eq__ does and keeps count of the rule that matched.
+    """
+
+    EXACT = 'exact'
+    ROMAN_NUMERALS = 'roman numerals'
+
+    def __init__(self, games = None):
+        self._exact = {}
+        self._roman_numerals = {}
+        self.matches = { RecognizedGames.EXACT: 0, RecognizedGames.ROMAN_NUMERALS: 0 }
+        for game in games or []:
+            self.add(game)
+
+    def add(self, game):
+        self._exact.setdefault(game.sortTitle.lower(), game)
+        self._roman_numerals.setdefault(convert_romans_in_text(game.sortTitle.upper()), game)
+
+    def match(self, game):
+        """Returns the recognized game and the rule that matched it, or (None, None).
+        """
+        recognized = self._exact.get(game.sortTitle.lower())
+        if recognized is not None:
+            self.matches[RecognizedGames.EXACT] += 1
+            return recognized, RecognizedGames.EXACT
+
+        recognized = self._roman_numerals.get(convert_romans_in_text(game.sortTitle.upper()))
+        if recognized is not None:
+            self.matches[RecognizedGames.ROMAN_NUMERALS] += 1
+            return recognized, RecognizedGames.ROMAN_NUMERALS
+
+        return None, None
+
+    def log_matches(self):
+        logger.info('Recognized by nvidia: {} exact matches, {} roman numerals matches'.format(
+            self.matches[RecognizedGames.EXACT], self.matches[RecognizedGames.ROMAN_NUMERALS]))
+
+    def __contains__(self, game):
+        return self.match(game)[0] is not None
+
+    def __len__(self):
+        return len(self._exact)
+
+class ShieldMirror(object):
+    """The Shield Apps entries made for an output folder: per file title, the lnk and
+    box-art copied there. A file is copied again only when it differs from its source
+    in size, or in mtime and content, and is hardlinked when both are on one volume.
+    Entries of games that left the library are swept. Stored as a JSON file in the
+    output folder, next to the manifest.
+    """
+
+    FILE_NAME = '.goglinks_shield.json'
+
+    def __init__(self, output_folder, shield_folder):
+        self.shield_folder = shield_folder
+        self.path = os.path.join(output_folder, ShieldMirror.FILE_NAME)
+        self.games = {}
+        self.counts = { 'linked': 0, 'copied': 0, 'unchanged': 0, 'removed': 0 }
+        self._kept = set()
+        self._link = True
+        self._dirty = False
+
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if os.path.normcase(os.path.abspath(data.get('shield', ''))) == os.path.normcase(os.path.abspath(shield_folder)):
+                    self.games = data.get('games', {})
+                else:
+                    logger.warn('Shield mirror {} was made for {}, starting empty'.format(self.path, data.get('shield')))
+            except (OSError, ValueError) as ex:
+                logger.warn('Shield mirror {} unreadable, starting empty: {}'.format(self.path, ex))
+
+    def mirror(self, title, pairs, overwrite = False):
+        """Brings every (source, destination) pair of the game up to date. Destinations
+        the mirror did not make are only replaced with overwrite.
+        """
+        mirrored = self.games.get(title, [])
+        entry = []
+        for source, dest in pairs:
+            relative = os.path.relpath(dest, self.shield_folder)
+            source_stat = file_index.stat(source)
+            if source_stat is None:
+                logger.debug(' %s not found, not mirrored', source)
+                if relative in mirrored:
+                    entry.append(relative)
+                continue
+            dest_stat = file_index.stat(dest)
+            if dest_stat is not None and relative not in mirrored and not overwrite:
+                continue
+
+            if dest_stat is not None and self._same(source, source_stat, dest, dest_stat):
+                self.counts['unchanged'] += 1
+            else:
+                logger.debug('Mirroring %s to %s', source, dest)
+                self.counts[self._sync(source, dest)] += 1
+            entry.append(relative)
+
+        if entry != mirrored:
+            self.games[title] = entry
+            self._dirty = True
+        self._kept.add(title)
+
+    def keep(self, title):
+        self._kept.add(title)
+
+    def drop(self, title, paths = ()):
+        """Removes the Shield entry of the game, and the paths, when it should not be there.
+        """
+        relatives = set(self.games.pop(title, []))
+        relatives.update(os.path.relpath(path, self.shield_folder) for path in paths)
+        self._dirty = True
+        self._remove(relatives)
+
+    def sweep(self):
+        """Removes the entries of the games that were not kept since the last sweep.
+        """
+        orphans = [title for title in self.games if title not in self._kept]
+        self._kept = set()
+        relatives = set()
+        for title in orphans:
+            relatives.update(self.games.pop(title))
+        if orphans:
+            self._dirty = True
+            logger.info('Swept {} Shield entries of games no longer in the library'.format(len(orphans)))
+        self._remove(relatives)
+
+    def save(self):
+        logger.info('Shield mirror: {linked} linked, {copied} copied, {unchanged} unchanged, {removed} removed'.format(**self.counts))
+        for name, value in self.counts.items():
+            metrics.count('shield_{}'.format(name), value)
+        if not self._dirty:
+            return
+        temp_path = self.path + NET_PART_SUFFIX
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({ 'shield': self.shield_folder, 'games': self.games }, f)
+            os.replace(temp_path, self.path)
+            self._dirty = False
+        except OSError as ex:
+            logger.error('(OSError) Cannot write Shield mirror {}'.format(self.path))
+            logger.error('(OSError) Message "{0}"'.format(str(ex)))
+
+    def _same(self, source, source_stat, dest, dest_stat):
+        if source_stat == dest_stat:
+            return True
+        if source_stat[0] != dest_stat[0] or file_digest(source) != file_digest(dest):
+            return False
+        # Same content, take over the mtime so the next run decides on the stat alone.
+        shutil.copystat(source, dest)
+        file_index.add(dest)
+        return True
+
+    def _sync(self, source, dest):
+        file_index.makedirs(os.path.dirname(dest))
+        temp_path = dest + NET_PART_SUFFIX
+        if file_index.exists(temp_path):
+            os.remove(temp_path)
+            file_index.discard(temp_path)
+
+        action = 'copied'
+        if self._link:
+            try:
+                os.link(source, temp_path)
+                action = 'linked'
+            except OSError:
+                # Another volume, or a file system without hardlinks.
+                self._link = False
+        if action == 'copied':
+            shutil.copy2(source, temp_path)
+        os.replace(temp_path, dest)
+        file_index.add(dest)
+        return action
+
+    def _remove(self, relatives):
+        for relative in relatives:
+            path = os.path.join(self.shield_folder, relative)
+            try:
+                os.remove(path)
+                file_index.discard(path)
+                self.counts['removed'] += 1
+                logger.debug('  Removed %s', path)
+            except FileNotFoundError:
+                continue
+            except OSError as ex:
+                logger.error('(OSError) Cannot remove {}: {}'.format(path, ex))
+                continue
+
+            # Remove the StreamingAssets folder of the game once it is empty.
+            folder = os.path.dirname(path)
+            while os.path.normpath(folder) != os.path.normpath(self.shield_folder) and \
+                    os.path.basename(folder) != 'StreamingAssets' and os.path.isdir(folder) and not os.listdir(folder):
+                os.rmdir(folder)
+                file_index.discard(folder)
+                folder = os.path.dirname(folder)
+
+class RunTarget(object):
+    """An output folder with its layout, the stages run for it, the catalogs exported
+    to it and the GOG users whose games it gets, None for all. The targets of a run
+    share the games loaded from the db and the image cache, so every image is
+    downloaded once and placed in each target that uses it.
+    """
+
+    def __init__(self, output_folder, folder_style = 'AEL', create_nfo = False, download_images = False, \
+            create_lnks = False, add_to_shield = False, overwrite = False, users = None, exports = None, \
+            shield_folder = None):
+        self.output_folder = output_folder
+        self.folder_style = folder_style
+        self.create_nfo = create_nfo
+        self.download_images = download_images
+        self.create_lnks = create_lnks
+        self.add_to_shield = add_to_shield
+        self.shield_folder = shield_folder
+        self.overwrite = overwrite
+        self.users = set(users) if users is not None else None
+        self.exports = list(exports or [])
+        self.manifest = SyncManifest(output_folder) if create_nfo or download_images else None
+
+    def select(self, games):
+        """Returns the games of the target's users, every release once.
+        """
+        selected = []
+        seen = set()
+        for game in games:
+            if self.users is not None and game.user_id not in self.users:
+                continue
+            if game.id in seen:
+                continue
+            seen.add(game.id)
+            selected.append(game)
+        return selected
+
+    def incomplete(self, game):
+        """True when a file of the game's enabled stages is missing from the output folder,
+        see file_index, or the manifest has the game's NFO or images invalidated.
+        """
+        nfo_folder = os.path.join(self.output_folder, 'games')
+        if self.create_nfo and (not file_index.exists(os.path.join(nfo_folder, '{}.nfo'.format(game.fileTitle))) or \
+                self.manifest.changed(game, SyncManifest.NFO)):
+            return True
+        if self.create_lnks and not file_index.exists(os.path.join(nfo_folder, '{}.lnk'.format(game.fileTitle))):
+            return True
+        if self.download_images:
+            if self.manifest.changed(game, SyncManifest.IMAGES):
+                return True
+            for _, url, path in image_targets(game, self.output_folder, self.folder_style):
+                if url is not None and not file_index.exists(path):
+                    return True
+        return False
+
+    @staticmethod
+    def all_users(targets):
+        # The users to load from the db for the targets, None when a target takes all.
+        users = set()
+        for target in targets:
+            if target.users is None:
+                return None
+            users |= target.users
+        return users
+
+class SyncManifest(object):
+    """Remembers, per game and stage, a fingerprint of the GamePieces the artifacts
+    were made from and which files they are. Games whose fingerprint changed are
+    made again, and the artifacts of games that left the library are pruned.
+    Stored as a JSON file in the output folder.
+    """
+
+    NFO = 'nfo'
+    IMAGES = 'images'
+    FILE_NAME = '.goglinks_manifest.json'
+
+    def __init__(self, output_folder):
+        self.output_folder = output_folder
+        self.path = os.path.join(output_folder, SyncManifest.FILE_NAME)
+        self.games = {}
+        self._kept = set()
+        self._lock = threading.Lock()
+
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.games = json.load(f).get('games', {})
+            except (OSError, ValueError) as ex:
+                logger.warn('Manifest {} unreadable, starting empty: {}'.format(self.path, ex))
+
+    def changed(self, game, stage):
+        """True when the game was made before from other GamePieces than it has now.
+        """
+        entry = self.games.get(game.id, {}).get(stage)
+        return entry is not None and entry['fingerprint'] != game.fingerprint(stage)
+
+    def record(self, game, stage, paths):
+        artifacts = [os.path.relpath(path, self.output_folder) for path in paths]
+        with self._lock:
+            entry = self.games.setdefault(game.id, {})
+            previous = entry.get(stage)
+            entry[stage] = { 'fingerprint': game.fingerprint(stage), 'artifacts': artifacts }
+            self._kept.add(game.id)
+
+            # A renamed game leaves its old files behind, remove them.
+            if previous is not None:
+                obsolete = set(previous['artifacts']) - set(artifacts)
+                if obsolete:
+                    self._remove(obsolete - self._artifacts_in_use())
+
+    def keep(self, game):
+        with self._lock:
+            self._kept.add(game.id)
+
+    def invalidate(self, game, stage):
+        # The artifacts of the stage are made again by the next run, as if the game changed.
+        with self._lock:
+            entry = self.games.get(game.id, {}).get(stage)
+            if entry is not None:
+                entry['fingerprint'] = None
+
+    def prune(self):
+        """Removes the artifacts of the games that were not kept in this run, or
+        watch pass, and starts over for the next one.
+        """
+        with self._lock:
+            removed = [key for key in self.games if key not in self._kept]
+            self._kept = set()
+            if not removed:
+                return
+
+            artifacts = set()
+            for key in removed:
+                for entry in self.games.pop(key).values():
+                    artifacts.update(entry['artifacts'])
+            count = self._remove(artifacts - self._artifacts_in_use())
+        logger.info('Pruned {} files of {} games no longer in the library'.format(count, len(removed)))
+
+    def save(self):
+        temp_path = self.path + NET_PART_SUFFIX
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({ 'games': self.games }, f)
+            os.replace(temp_path, self.path)
+        except OSError as ex:
+            logger.error('(OSError) Cannot write manifest {}'.format(self.path))
+            logger.error('(OSError) Message "{0}"'.format(str(ex)))
+
+    def _artifacts_in_use(self):
+        # Different releases can share a file title, and so their files.
+        return set(artifact for entry in self.games.values() for stage in entry.values() for artifact in stage['artifacts'])
+
+    def _remove(self, artifacts):
+        count = 0
+        for artifact in artifacts:
+            path = os.path.join(self.output_folder, artifact)
+            try:
+                os.remove(path)
+                file_index.discard(path)
+                count += 1
+                logger.debug('  Removed %s', path)
+            except FileNotFoundError:
+                continue
+            except OSError as ex:
+                logger.error('(OSError) Cannot remove {}: {}'.format(path, ex))
+                continue
+
+            # Remove the folders the file leaves empty, like the per game folder of the Kodi style.
+            folder = os.path.dirname(path)
+            while os.path.normpath(folder) != os.path.normpath(self.output_folder) and \
+                    os.path.isdir(folder) and not os.listdir(folder):
+                os.rmdir(folder)
+                file_index.discard(folder)
+                folder = os.path.dirname(folder)
+        return count
+
+class CatalogExport(object):
+    """One catalog file with the NFO fields of every game, written as the games come:
+
+    xml    games.xml, a multi-game XML database as AEL's offline scraper reads it:
+           a <menu> with a <game name="..."> per game, see write_ael_game
+    jsonl  games.jsonl, a JSON object per line
+    sqlite games.db, a games table with a row per game, lists as JSON text
+
+    In the xml catalog a game is named by its file title, the name of its lnk, which
+    AEL takes as the ROM name when it scans the lnks, and carries its releaseKey as
+    an attribute. In the others every game is keyed by its releaseKey. The file is
+    written under a temporary name and renamed once complete, so readers never see
+    half a catalog.
+    """
+
+    COLUMNS = ('releaseKey',) + NFO_TEXT_FIELDS + NFO_IMAGE_FIELDS + ('screenshots', 'trailer', 'videos')
+
+    def __init__(self, output_folder, fmt):
+        if fmt not in EXPORT_FILES:
+            raise ValueError('Unknown export format {}'.format(fmt))
+        self.format = fmt
+        self.path = os.path.join(output_folder, EXPORT_FILES[fmt])
+        self.count = 0
+        self._temp_path = self.path + NET_PART_SUFFIX
+        self._file = None
+        self._conn = None
+
+        file_index.makedirs(output_folder)
+        if os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
+        if fmt == 'sqlite':
+            # The temporary file is thrown away on failure, it needs no journal.
+            self._conn = sqlite3.connect(self._temp_path)
+            self._conn.execute('PRAGMA journal_mode = OFF')
+            self._conn.execute('PRAGMA synchronous = OFF')
+            self._conn.execute('CREATE TABLE games ({})'.format(', '.join(
+                '{} TEXT{}'.format(column, ' PRIMARY KEY' if column == 'releaseKey' else '') for column in self.COLUMNS)))
+            self._insert = 'INSERT OR REPLACE INTO games VALUES ({})'.format(', '.join('?' * len(self.COLUMNS)))
+        else:
+            self._file = open(self._temp_path, 'w', encoding='utf-8', newline='\n')
+            if fmt == 'xml':
+                self._file.write('<?xml version="1.0" encoding="utf-8"?>\n<menu>\n')
+                self._file.write('{0}<header>\n{0}{0}<listname>{1}</listname>\n{0}</header>\n'.format(XML_INDENT,
+                    AEL_XML_LIST_NAME))
+
+    def write(self, game):
+        record = nfo_record(game)
+        if self.format == 'xml':
+            write_ael_game(self._file, 1, game.fileTitle, record, ' releaseKey="{}"'.format(xml_escape_text(game.id)))
+        elif self.format == 'jsonl':
+            record = dict(releaseKey=game.id, **record)
+            self._file.write(json.dumps(record, ensure_ascii=False))
+            self._file.write('\n')
+        else:
+            record['screenshots'] = json.dumps(record['screenshots'])
+            record['videos'] = json.dumps(record['videos'])
+            record['releaseKey'] = game.id
+            self._conn.execute(self._insert, [record[column] for column in self.COLUMNS])
+        self.count += 1
+
+    def close(self, complete = True):
+        """Renames the finished catalog into place, or with complete False removes it.
+        """
+        if self._file is not None:
+            if complete and self.format == 'xml':
+                self._file.write('</menu>\n')
+            self._file.close()
+        if self._conn is not None:
+            if complete:
+                self._conn.commit()
+            self._conn.close()
+
+        if not complete:
+            os.remove(self._temp_path)
+            return
+        os.replace(self._temp_path, self.path)
+        file_index.add(self.path)
+        logger.info('Exported {} games to {}'.format(self.count, self.path))
+
+class ImageStore(object):
+    """Content addressed cache of downloaded images. Every URL is fetched once and
+    stored under the hash of its content, so identical images are stored once.
+    Output files are hardlinked to the cached copy, or copied when the file system
+    does not support hardlinks. The cache is trimmed to max_size bytes, least
+    recently used images first, when it is closed.
+    The ETag and Last-Modified headers of every URL are kept as well, so a refresh
+    asks the CDN whether the image changed and only downloads it again when it did.
+    """
+
+    def __init__(self, folder, max_size):
+        self.folder = folder
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+
+        self._index_path = os.path.join(folder, 'index.json')
+        self._objects_folder = os.path.join(folder, 'objects')
+        self._temp_folder = os.path.join(folder, 'tmp')
+        os.makedirs(self._objects_folder, exist_ok=True)
+        os.makedirs(self._temp_folder, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._url_locks = {}
+        self._refreshed = set()
+
+        self.urls = {}
+        self.objects = {}
+        self.validators = {}
+        if os.path.exists(self._index_path):
+            try:
+                with open(self._index_path, 'r', encoding='utf-8') as f:
+                    index = json.load(f)
+                self.urls = index.get('urls', {})
+                self.objects = index.get('objects', {})
+                self.validators = index.get('validators', {})
+            except (OSError, ValueError) as ex:
+                logger.warn('Image cache index {} unreadable, starting empty: {}'.format(self._index_path, ex))
+
+    def fetch(self, img_url, connections = None, refresh = False):
+        """Returns the path of the cached image for the URL, downloading it when it is
+        not cached yet. With refresh the URL is revalidated with the CDN, once per run,
+        and downloaded again when the image changed or has no validators.
+        """
+        with self._lock:
+            url_lock = self._url_locks.setdefault(img_url, threading.Lock())
+
+        with url_lock:
+            with self._lock:
+                object_path = self._cached_path(img_url)
+                if self._hit(img_url, object_path, refresh):
+                    return object_path
+                validators = self._validators(img_url) if object_path is not None else None
+
+            temp_path = os.path.join(self._temp_folder, hashlib.sha1(img_url.encode('utf-8')).hexdigest())
+            new_validators = net_download_img(img_url, temp_path, connections, validators)
+            if new_validators is None:
+                with self._lock:
+                    self.objects[self.urls[img_url]]['used'] = time.time()
+                    self._refreshed.add(img_url)
+                    self.revalidated += 1
+                return object_path
+            digest, size = file_digest(temp_path)
+
+            with self._lock:
+                object_path = self._object_path(digest)
+                if os.path.exists(object_path):
+                    os.remove(temp_path)
+                else:
+                    os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                    os.replace(temp_path, object_path)
+                self.urls[img_url] = digest
+                self.objects[digest] = { 'size': size, 'used': time.time() }
+                self.validators[img_url] = new_validators
+                self._refreshed.add(img_url)
+                self.misses += 1
+            return object_path
+
+    def cached(self, img_url, refresh = False):
+        """Returns the path of the cached image for the URL when fetch would return it
+        without a request, None otherwise.
+        """
+        with self._lock:
+            object_path = self._cached_path(img_url)
+            return object_path if self._hit(img_url, object_path, refresh) else None
+
+    def place(self, object_path, file_path):
+        """Puts the cached image at file_path, replacing what is there. Nothing is
+        written when file_path already has the size and mtime of the cached image,
+        as it does after a revalidated image was placed before.
+        """
+        stat = os.stat(object_path)
+        if file_index.stat(file_path) == (stat.st_size, stat.st_mtime):
+            return
+
+        folder = os.path.dirname(file_path)
+        if folder:
+            file_index.makedirs(folder)
+
+        temp_path = file_path + NET_PART_SUFFIX
+        if file_index.exists(temp_path):
+            os.remove(temp_path)
+            file_index.discard(temp_path)
+        try:
+            os.link(object_path, temp_path)
+        except OSError:
+            # Copied with the mtime, so the next run sees the copy is up to date.
+            shutil.copy2(object_path, temp_path)
+        os.replace(temp_path, file_path)
+        file_index.add(file_path)
+
+    def close(self):
+        self._evict()
+        temp_path = self._index_path + NET_PART_SUFFIX
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({ 'urls': self.urls, 'objects': self.objects, 'validators': self.validators }, f)
+            os.replace(temp_path, self._index_path)
+        except OSError as ex:
+            logger.error('(OSError) Cannot write image cache index {}'.format(self._index_path))
+            logger.error('(OSError) Message "{0}"'.format(str(ex)))
+
+        logger.info('Image cache: {} hits, {} revalidated, {} misses, {} images, {:.1f} MB'.format(
+            self.hits, self.revalidated, self.misses, len(self.objects), self._size() / (1024 * 1024)))
+
+    def _cached_path(self, img_url):
+        digest = self.urls.get(img_url)
+        if digest is None or digest not in self.objects:
+            return None
+        object_path = self._object_path(digest)
+        return object_path if os.path.exists(object_path) else None
+
+    def _hit(self, img_url, object_path, refresh):
+        # A refreshed image is revalidated once per run, after that it is a hit as well.
+        if object_path is None or (refresh and img_url not in self._refreshed):
+            return False
+        self.objects[self.urls[img_url]]['used'] = time.time()
+        self.hits += 1
+        return True
+
+    def _validators(self, img_url):
+        # Only validators of the cached image are usable, the length tells them apart
+        # from validators of an image that was replaced in the meantime.
+        validators = self.validators.get(img_url)
+        if not validators or not ('etag' in validators or 'modified' in validators):
+            return None
+        if validators.get('length') != self.objects[self.urls[img_url]]['size']:
+            return None
+        return validators
+
+    def _object_path(self, digest):
+        return os.path.join(self._objects_folder, digest[:2], digest)
+
+    def _size(self):
+        return sum(entry['size'] for entry in self.objects.values())
+
+    def _evict(self):
+        size = self._size()
+        if size <= self.max_size:
+            return
+
+        evicted = set()
+        for digest, entry in sorted(self.objects.items(), key=lambda item: item[1]['used']):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(self._object_path(digest))
+            except OSError:
+                pass
+            size -= entry['size']
+            evicted.add(digest)
+
+        for digest in evicted:
+            del self.objects[digest]
+        self.urls = { url: digest for url, digest in self.urls.items() if digest not in evicted }
+        self.validators = { url: v for url, v in self.validators.items() if url in self.urls }
+        logger.info('Image cache: evicted {} least recently used images'.format(len(evicted)))
+
+class HttpStatusError(IOError):
+
+    def __init__(self, status, url, retry_after = None):
+        super(HttpStatusError, self).__init__('HTTP {} for {}'.format(status, url))
+        self.status = status
+        self.url = url
+        self.retry_after = retry_after
+
+    def retryable(self):
+        return self.status == 429 or self.status >= 500
+
+class HostRateControl(object):
+    """Limits the requests in flight to one host with AIMD: the limit grows by one
+    for every limit's worth of successful requests and is halved when the host
+    throttles, fails or times out. A host that sends Retry-After is also paused
+    for that delay, no request is sent to it until then.
+    """
+
+    def __init__(self, host, max_in_flight):
+        self.host = host
+        self.max_in_flight = max_in_flight
+        self.limit = float(max_in_flight)
+        self.min_limit = self.limit
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.decreased_at = 0.0
+        self.requests = 0
+        self.retries = 0
+        self.decreases = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        # Returns when the request may be sent, with the time it was let through.
+        with self._cond:
+            while True:
+                wait = self.paused_until - time.monotonic()
+                if wait <= 0 and self.in_flight < int(self.limit):
+                    break
+                self._cond.wait(wait if wait > 0 else None)
+            self.in_flight += 1
+            self.requests += 1
+            return time.monotonic()
+
+    def release(self, ok):
+        with self._cond:
+            self.in_flight -= 1
+            if ok:
+                self.limit = min(float(self.max_in_flight), self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+    def backoff(self, started, retry_after = None):
+        with self._cond:
+            self.retries += 1
+            # Requests that were already in flight when the limit was halved were sent
+            # under the old limit, the limit is only halved once for them.
+            now = time.monotonic()
+            if started >= self.decreased_at:
+                self.limit = max(1.0, self.limit / 2)
+                self.min_limit = min(self.min_limit, self.limit)
+                self.decreases += 1
+                self.decreased_at = now
+            if retry_after is not None:
+                self.paused_until = max(self.paused_until, now + retry_after)
+            self._cond.notify_all()
+
+class RateController(object):
+    """The HostRateControl of every host images are fetched from.
+    """
+
+    def __init__(self, max_in_flight = DEFAULT_WORKERS):
+        self._lock = threading.Lock()
+        self.reset(max_in_flight)
+
+    def reset(self, max_in_flight):
+        with self._lock:
+            self.max_in_flight = max_in_flight
+            self.hosts = {}
+
+    def host(self, url):
+        netloc = urlsplit(url).netloc
+        with self._lock:
+            host = self.hosts.get(netloc)
+            if host is None:
+                host = self.hosts[netloc] = HostRateControl(netloc, self.max_in_flight)
+            return host
+
+    def log_summary(self):
+        with self._lock:
+            hosts = list(self.hosts.values())
+        for host in hosts:
+            logger.info('Host {}: {} requests, {} retries, limit halved {} times, in-flight limit {} (lowest {})'.format(
+                host.host, host.requests, host.retries, host.decreases, int(host.limit), int(host.min_limit)))
+        metrics.set('http_requests', sum(host.requests for host in hosts))
+        metrics.set('http_retries', sum(host.retries for host in hosts))
+        metrics.set('http_limit_decreases', sum(host.decreases for host in hosts))
+
+class TimeBudget(object):
+    """The seconds a run, or watch pass, may spend downloading images, None for no limit,
+    counted from the first image queued. Once used up the images that did not start yet
+    and are not in the image cache are deferred to the next run, or watch pass, the
+    downloads in flight are finished.
+    The images are in priority order within a target. The targets of a run are run one
+    after the other, so the budget goes to the first target's images first, the images
+    a later target shares with it are then placed from the cache.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self, seconds = None):
+        self.seconds = seconds
+        self.restart()
+
+    def restart(self):
+        # The clock starts again with the next image queued.
+        self.started = None
+        self._logged = False
+
+    def start(self):
+        if self.started is None:
+            self.started = time.monotonic()
+
+    def expired(self):
+        if self.seconds is None or self.started is None or time.monotonic() - self.started < self.seconds:
+            return False
+        if not self._logged:
+            self._logged = True
+            logger.info('Time budget of {} s used up, deferring the remaining images'.format(self.seconds))
+        return True
+
+class DownloadResult(object):
+
+    OK = 'ok'
+    SKIPPED = 'skipped'
+    FAILED = 'failed'
+    DEFERRED = 'deferred'
+
+    def __init__(self, title, kind, url, file_path, status, error = None):
+        self.title = title
+        self.kind = kind
+        self.url = url
+        self.file_path = file_path
+        self.status = status
+        self.error = error
+
+    @staticmethod
+    def missing(future):
+        # True when the image of the download future was not put in place: it failed, was
+        # deferred or cancelled.
+        return future.cancelled() or future.exception() is not None or \
+            future.result().status in (DownloadResult.FAILED, DownloadResult.DEFERRED)
+
+class ImageDownloader(object):
+    """Downloads images with a bounded number of worker threads.
+    Every worker keeps its own keep-alive connection per CDN host.
+    A free worker takes the queued image with the highest priority, see image_priority,
+    and once the time budget is used up the images still queued are deferred, unless
+    they are in the image cache.
+    Every destination is downloaded once. Releases that share a file title get the
+    future of the first one that was submitted.
+    """
+
+    def __init__(self, workers = DEFAULT_WORKERS, store = None):
+        self.workers = workers
+        self.store = store
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        self._pending = []
+        self._destinations = {}
+        self._queue = []
+        self._sequence = itertools.count()
+        self._holding = False
+        self._held = 0
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='img')
+
+    def submit(self, game, kind, img_url, file_path, overwrite_existing):
+        if img_url is None:
+            return None
+
+        destination = os.path.normcase(os.path.abspath(file_path))
+        if destination in self._destinations:
+            return self._destinations[destination]
+
+        future = self._destinations[destination] = Future()
+        if not overwrite_existing and file_index.exists(file_path):
+            future.set_result(DownloadResult(game.title, kind, img_url, file_path, DownloadResult.SKIPPED))
+        else:
+            time_budget.start()
+            with self._lock:
+                heapq.heappush(self._queue, (image_priority(game, kind), next(self._sequence), future,
+                    (game.title, kind, img_url, file_path, overwrite_existing)))
+            if self._holding:
+                self._held += 1
+            else:
+                self._pool.submit(self._download_next)
+
+        self._pending.append(future)
+        return future
+
+    @contextmanager
+    def hold(self):
+        """Queues the images submitted in the block and only then starts them, so they
+        are downloaded in priority order across all of them.
+        """
+        self._holding = True
+        try:
+            yield
+        finally:
+            self._holding = False
+            for _ in range(self._held):
+                self._pool.submit(self._download_next)
+            self._held = 0
+
+    def close(self, cancel = False):
+        """Waits for all submitted images and returns the results in submission order.
+        With cancel the images that did not start yet are dropped.
+        """
+        self._pool.shutdown(wait=True, cancel_futures=cancel)
+        for _, _, future, _ in self._queue:
+            future.cancel()
+        self._queue = []
+        results = []
+        for future in self._pending:
+            if future.cancelled():
+                continue
+            if future.exception() is not None:
+                logger.error('(Exception) Object type "{}"'.format(type(future.exception())))
+                logger.error('(Exception) Message "{}"'.format(str(future.exception())))
+                continue
+            results.append(future.result())
+        self._pending = []
+        self._destinations = {}
+        for connections in self._connections:
+            for conn in connections.values():
+                conn.close()
+        self._connections = []
+        return results
+
+    def cancel(self):
+        # Cancels the images that did not start yet.
+        with self._lock:
+            queued, self._queue = self._queue, []
+        for _, _, future, _ in queued:
+            future.cancel()
+
+    def _download_next(self):
+        with self._lock:
+            if not self._queue:
+                return
+            _, _, future, args = heapq.heappop(self._queue)
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(self._download(*args))
+        except Exception as ex:
+            # Never leave the future running, close() and the task graph wait for it.
+            future.set_exception(ex)
+
+    def _download(self, title, kind, img_url, file_path, refresh):
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+            with self._lock:
+                self._connections.append(connections)
+
+        try:
+            if time_budget.expired():
+                # Only requests are deferred, images in the cache are still placed.
+                object_path = self.store.cached(img_url, refresh) if self.store is not None else None
+                if object_path is None:
+                    return DownloadResult(title, kind, img_url, file_path, DownloadResult.DEFERRED)
+                self.store.place(object_path, file_path)
+            elif self.store is not None:
+                self.store.place(self.store.fetch(img_url, connections, refresh), file_path)
+            else:
+                net_download_img(img_url, file_path, connections)
+        except Exception as ex:
+            return DownloadResult(title, kind, img_url, file_path, DownloadResult.FAILED, ex)
+        return DownloadResult(title, kind, img_url, file_path, DownloadResult.OK)
+
+class TaskGraph(object):
+    """Runs every task on the executor for its kind of work once the tasks and futures
+    it depends on are done, whatever their outcome. Tasks of other kinds run meanwhile,
+    so NFOs and lnks are written while images download and a game's Shield entry is
+    made as soon as its lnk and cover are there. The wall time from the first task of
+    a stage to its last is recorded in the metrics.
+    """
+
+    def __init__(self, executors):
+        self.executors = executors
+        self._futures = []
+        self._names = []
+        self._tracked = []
+        self._spans = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, kind, func, *args, deps = ()):
+        """Returns the future of func(*args), run on the executor of kind.
+        """
+        future = Future()
+        pending = [dep for dep in deps if dep is not None]
+        remaining = [len(pending)]
+
+        def start():
+            if not future.cancelled():
+                self.executors[kind].submit(self._call, stage, future, func, args)
+
+        def dep_done(_):
+            with self._lock:
+                remaining[0] -= 1
+                ready = remaining[0] == 0
+            if ready:
+                start()
+
+        self._futures.append(future)
+        self._names.append(stage)
+        with self._lock:
+            self._counts[stage] = self._counts.get(stage, 0) + 1
+        if not pending:
+            start()
+        for dep in pending:
+            dep.add_done_callback(dep_done)
+        return future
+
+    def track(self, stage, future):
+        # Counts a future run elsewhere, like an image download, in the time of the stage.
+        if future is None:
+            return
+        self._tracked.append(future)
+        self._span(stage, time.perf_counter())
+        future.add_done_callback(lambda _: self._span(stage, time.perf_counter()))
+
+    def wait(self, stop = None):
+        """Waits for all tasks and tracked futures, logs the tasks that failed and records
+        the stage times. Returns False, without waiting for the rest, once stop is set.
+        """
+        # A cancelled future that never reached an executor is not done for wait_futures.
+        futures = [future for future in self._futures + self._tracked if not future.cancelled()]
+        while wait_futures(futures, timeout=WATCH_POLL_INTERVAL if stop is not None else None).not_done:
+            if stop.is_set():
+                return False
+        for stage, future in zip(self._names, self._futures):
+            if not future.cancelled() and future.exception() is not None:
+                ex = future.exception()
+                logger.error('(Exception) {} task failed'.format(stage))
+                logger.error('(Exception) Object type "{}"'.format(type(ex)))
+                logger.error('(Exception) Message "{}"'.format(str(ex)))
+        for stage, (first, last) in self._spans.items():
+            metrics.stage_seconds(stage, last - first)
+        for stage, count in self._counts.items():
+            metrics.stage_games(stage, count)
+        self._futures = []
+        self._names = []
+        self._tracked = []
+        self._spans = {}
+        self._counts = {}
+        return True
+
+    def cancel(self):
+        # Cancels the tasks that did not start yet, the running ones finish.
+        for future in self._futures:
+            future.cancel()
+
+    def _call(self, stage, future, func, args):
+        if not future.set_running_or_notify_cancel():
+            return
+        self._span(stage, time.perf_counter())
+        try:
+            future.set_result(func(*args))
+        except Exception as ex:
+            future.set_exception(ex)
+        self._span(stage, time.perf_counter())
+
+    def _span(self, stage, now):
+        with self._lock:
+            first, last = self._spans.get(stage, (now, now))
+            self._spans[stage] = (min(first, now), max(last, now))
+
+class FileIndex(object):
+    """The files and folders under the output folders, read with one os.scandir walk
+    per folder. Checking whether an output file exists then costs a dict lookup instead
+    of a stat, which is a network round trip when the output is on a share. Paths
+    outside the indexed folders are checked on disk. Files written or removed during
+    the run are recorded, so the index stays current.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._roots = []
+            self._skipped = []
+            self._files = {}
+            self._dirs = set()
+
+    def scan(self, folder):
+        """Indexes everything under folder, except the image cache.
+        """
+        root = self._key(folder)
+        files = {}
+        dirs = set()
+        skipped = []
+        pending = [folder]
+        while pending:
+            current = pending.pop()
+            try:
+                entries = list(os.scandir(current))
+            except FileNotFoundError:
+                continue
+            dirs.add(self._key(current))
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name != IMAGE_CACHE_FOLDER:
+                        pending.append(entry.path)
+                    else:
+                        skipped.append(self._key(entry.path))
+                else:
+                    stat = entry.stat(follow_symlinks=False)
+                    files[self._key(entry.path)] = (stat.st_size, stat.st_mtime)
+
+        with self._lock:
+            self._roots = [r for r in self._roots if r != root] + [root]
+            self._skipped.extend(skipped)
+            self._files.update(files)
+            self._dirs.update(dirs)
+        logger.debug('Indexed %d files in %d folders under %s', len(files), len(dirs), folder)
+
+    def exists(self, path):
+        key = self._key(path)
+        if not self._indexed(key):
+            return os.path.exists(path)
+        return key in self._files or key in self._dirs
+
+    def stat(self, path):
+        """Returns (size, mtime) of the file, None when it does not exist.
+        """
+        key = self._key(path)
+        if not self._indexed(key):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return None
+            return stat.st_size, stat.st_mtime
+        return self._files.get(key)
+
+    def makedirs(self, folder):
+        key = self._key(folder)
+        if key in self._dirs:
+            return
+        os.makedirs(folder, exist_ok=True)
+        if self._indexed(key):
+            with self._lock:
+                while key not in self._dirs and self._indexed(key):
+                    self._dirs.add(key)
+                    key = os.path.dirname(key)
+
+    def add(self, path):
+        # Records a file that was just written.
+        key = self._key(path)
+        if not self._indexed(key):
+            return
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.discard(path)
+            return
+        with self._lock:
+            self._files[key] = (stat.st_size, stat.st_mtime)
+
+    def discard(self, path):
+        # Records a file or folder that was removed.
+        key = self._key(path)
+        with self._lock:
+            self._files.pop(key, None)
+            self._dirs.discard(key)
+
+    def _indexed(self, key):
+        for root in self._skipped:
+            if key == root or key.startswith(root + os.sep):
+                return False
+        for root in self._roots:
+            if key == root or key.startswith(root + os.sep):
+                return True
+        return False
+
+    def _key(self, path):
+        return os.path.normcase(os.path.abspath(path))
+
+class GalaxyDbWatcher(object):
+    """Tells cheaply whether the GOG db changed since it was last asked. The db and
+    its write-ahead log are stat'ed, and PRAGMA data_version, which changes when
+    another connection commits, is read on a read-only connection kept open.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._conn = sqlite3.connect(galaxy_db_uri(db_path), uri=True, check_same_thread=False)
+        self._state = self._read()
+
+    def changed(self):
+        try:
+            state = self._read()
+        except (OSError, sqlite3.Error) as ex:
+            # Galaxy may hold an exclusive lock for a moment, ask again on the next poll.
+            logger.debug('Cannot check %s: %s', self.db_path, ex)
+            return False
+        changed = state != self._state
+        self._state = state
+        return changed
+
+    def close(self):
+        self._conn.close()
+
+    def _read(self):
+        files = []
+        for path in (self.db_path, self.db_path + '-wal'):
+            try:
+                stat = os.stat(path)
+                files.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                files.append(None)
+        return tuple(files), self._conn.execute('PRAGMA data_version').fetchone()[0]
+
+class RunMetrics(object):
+    """Wall time and games per stage, counters and the image request latency
+    histogram of a run. Written at exit as JSON and as a Prometheus textfile
+    for the textfile collector of the node exporter.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.stages = {}
+            self.counters = {}
+            self.latency_buckets = [0] * len(METRICS_LATENCY_BUCKETS)
+            self.latency_count = 0
+            self.latency_sum = 0.0
+
+    @contextmanager
+    def stage(self, name, games = None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_seconds(name, time.perf_counter() - start)
+            if games is not None:
+                self.stage_games(name, games)
+
+    def stage_seconds(self, name, seconds):
+        with self._lock:
+            self.stages.setdefault(name, { 'seconds': 0.0, 'games': 0 })['seconds'] += seconds
+
+    def stage_games(self, name, games):
+        with self._lock:
+            self.stages.setdefault(name, { 'seconds': 0.0, 'games': 0 })['games'] += games
+
+    def set(self, name, value):
+        with self._lock:
+            self.counters[name] = value
+
+    def count(self, name, value = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe_request(self, seconds):
+        with self._lock:
+            self.latency_count += 1
+            self.latency_sum += seconds
+            for i, bound in enumerate(METRICS_LATENCY_BUCKETS):
+                if seconds <= bound:
+                    self.latency_buckets[i] += 1
+                    break
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'started': self.started,
+                'seconds': time.time() - self.started,
+                'stages': { name: dict(entry) for name, entry in self.stages.items() },
+                'counters': dict(self.counters),
+                'request_latency': {
+                    'buckets': [[bound, count] for bound, count in zip(METRICS_LATENCY_BUCKETS, self.latency_buckets)],
+                    'count': self.latency_count,
+                    'sum': self.latency_sum
+                }
+            }
+
+    def write_json(self, file_path):
+        self._write(file_path, json.dumps(self.as_dict(), indent=2, sort_keys=True) + '\n')
+
+    def write_prometheus(self, file_path):
+        # Gauges, as the file describes the last run and is replaced by the next one.
+        data = self.as_dict()
+        lines = []
+        def metric(name, kind, help_text, samples):
+            name = '{}_{}'.format(METRICS_PREFIX, name)
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} {}'.format(name, kind))
+            for suffix, labels, value in samples:
+                label_text = ','.join('{}="{}"'.format(key, labels[key]) for key in sorted(labels))
+                lines.append('{}{}{} {}'.format(name, suffix, '{' + label_text + '}' if label_text else '', value))
+
+        metric('last_run_timestamp_seconds', 'gauge', 'Start time of the last run.', [('', {}, data['started'])])
+        metric('run_seconds', 'gauge', 'Wall time of the last run.', [('', {}, data['seconds'])])
+        stages = sorted(data['stages'].items())
+        metric('stage_seconds', 'gauge', 'Wall time of a stage in the last run.',
+            [('', { 'stage': name }, entry['seconds']) for name, entry in stages])
+        metric('stage_games', 'gauge', 'Games handled by a stage in the last run.',
+            [('', { 'stage': name }, entry['games']) for name, entry in stages])
+        for name, value in sorted(data['counters'].items()):
+            metric(name, 'gauge', '{} in the last run.'.format(name.replace('_', ' ').capitalize()), [('', {}, value)])
+
+        samples = []
+        cumulative = 0
+        for bound, count in data['request_latency']['buckets']:
+            cumulative += count
+            samples.append(('_bucket', { 'le': str(bound) }, cumulative))
+        samples.append(('_bucket', { 'le': '+Inf' }, data['request_latency']['count']))
+        samples.append(('_sum', {}, data['request_latency']['sum']))
+        samples.append(('_count', {}, data['request_latency']['count']))
+        metric('request_latency_seconds', 'histogram', 'Time to the response headers of image requests.', samples)
+
+        self._write(file_path, '\n'.join(lines) + '\n')
+
+    def _write(self, file_path, text):
+        # Written next to the target and renamed, so a reader never sees half a file.
+        temp_path = file_path + NET_PART_SUFFIX
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(temp_path, file_path)
+        except OSError as ex:
+            logger.error('(OSError) Cannot write metrics file {}'.format(file_path))
+            logger.error('(OSError) Message "{0}"'.format(str(ex)))
+
+class ThreadProfiler(object):
+    """cProfile for the calling thread and every thread started while enabled, like
+    the disk, shield and image workers, dumped as one merged profile.
+    """
+
+    def __init__(self):
+        self._profiles = []
+        self._lock = threading.Lock()
+
+    def enable(self):
+        threading.setprofile(self._profile_thread)
+        self._profile_thread()
+
+    def disable(self):
+        # Called on the enabling thread, the workers have finished by then.
+        threading.setprofile(None)
+        if self._profiles:
+            self._profiles[0].disable()
+
+    def dump_stats(self, file_path):
+        stats = pstats.Stats(*self._profiles)
+        stats.dump_stats(file_path)
+
+    def _profile_thread(self, *args):
+        # The first profile event of a new thread hands it over to a profiler of its own.
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12 and later profile every thread with the profiler that is enabled.
+            sys.setprofile(None)
+            return
+        with self._lock:
+            self._profiles.append(profile)
+
+metrics = RunMetrics()
+rate_control = RateController()
+time_budget = TimeBudget()
+file_index = FileIndex()
+
 if __name__ == "__main__":
     main(sys.argv[1:])
\ No newline at end of file
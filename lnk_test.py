@@ -0,0 +1,146 @@
+import ntpath
+import os
+import struct
+import tempfile
+import unittest
+
+import goglinks
+
+LNK_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_data', 'lnk')
+ARGUMENTS = '/command=runGame /gameId=1207658924'
+MY_COMPUTER_CLSID = bytes.fromhex('e04fd020ea3a6910a2d808002b30309d')
+
+def parse_lnk(data):
+    """Reads a shortcut as MS-SHLLINK lays it out, independent of goglinks' writer.
+    Returns the header flags, the IDList items, the LinkInfo fields and the arguments.
+    """
+    header_size, clsid, flags = struct.unpack_from('<I16sI', data, 0)
+    assert header_size == 0x4C, 'HeaderSize {:#x}'.format(header_size)
+    assert clsid == goglinks.LNK_CLSID, 'LinkCLSID {}'.format(clsid.hex())
+    lnk = { 'flags': flags, 'items': [], 'link_info': None, 'arguments': None }
+    offset = header_size
+
+    if flags & goglinks.LNK_HAS_TARGET_ID_LIST:
+        id_list_size, = struct.unpack_from('<H', data, offset)
+        offset += 2
+        end = offset + id_list_size
+        while True:
+            item_size, = struct.unpack_from('<H', data, offset)
+            if item_size == 0:
+                offset += 2
+                break
+            assert item_size > 2 and offset + item_size <= end - 2, 'ItemID size {}'.format(item_size)
+            lnk['items'].append(data[offset + 2:offset + item_size])
+            offset += item_size
+        assert offset == end, 'IDListSize {} does not end at the TerminalID'.format(id_list_size)
+
+    if flags & goglinks.LNK_HAS_LINK_INFO:
+        size, info_header_size, info_flags, volume_id_offset, base_path_offset, network_offset, suffix_offset = \
+            struct.unpack_from('<IIIIIII', data, offset)
+        info = data[offset:offset + size]
+        assert len(info) == size, 'LinkInfoSize {} past the end'.format(size)
+        assert info_header_size in (0x1C, 0x24), 'LinkInfoHeaderSize {:#x}'.format(info_header_size)
+        fields = { 'flags': info_flags, 'network_offset': network_offset }
+        for name, field_offset in (('volume_id', volume_id_offset), ('base_path', base_path_offset),
+                ('suffix', suffix_offset)):
+            assert info_header_size <= field_offset < size, '{} offset {} outside LinkInfo'.format(name, field_offset)
+
+        volume_id_size, drive_type, serial, label_offset = struct.unpack_from('<IIII', info, volume_id_offset)
+        assert volume_id_size > 0x10 and volume_id_offset + volume_id_size <= size, 'VolumeIDSize {}'.format(volume_id_size)
+        assert label_offset < volume_id_size, 'VolumeLabelOffset {}'.format(label_offset)
+        fields['drive_type'] = drive_type
+        fields['base_path'] = info[base_path_offset:info.index(b'\x00', base_path_offset)].decode(goglinks.LNK_ANSI_ENCODING)
+        fields['suffix'] = info[suffix_offset:info.index(b'\x00', suffix_offset)].decode(goglinks.LNK_ANSI_ENCODING)
+
+        if info_header_size == 0x24:
+            base_path_unicode_offset, suffix_unicode_offset = struct.unpack_from('<II', info, 0x1C)
+            for field_offset in (base_path_unicode_offset, suffix_unicode_offset):
+                assert info_header_size <= field_offset < size, 'unicode offset {} outside LinkInfo'.format(field_offset)
+            fields['base_path_unicode'] = read_utf16z(info, base_path_unicode_offset)
+            fields['suffix_unicode'] = read_utf16z(info, suffix_unicode_offset)
+        lnk['link_info'] = fields
+        offset += size
+
+    if flags & goglinks.LNK_HAS_ARGUMENTS:
+        count, = struct.unpack_from('<H', data, offset)
+        lnk['arguments'] = data[offset + 2:offset + 2 + 2 * count].decode('utf-16-le')
+        offset += 2 + 2 * count
+
+    # No ExtraData blocks, only the TerminalBlock.
+    assert data[offset:] == bytes(4), 'ExtraData {}'.format(data[offset:].hex())
+    return lnk
+
+def read_utf16z(data, offset):
+    end = offset
+    while data[end:end + 2] != b'\x00\x00':
+        end += 2
+    return data[offset:end].decode('utf-16-le')
+
+def item_name(item):
+    # A file or folder shell item: type, unknown, file size, FAT date time, attributes, name.
+    return item[12:item.index(b'\x00', 12)].decode(goglinks.LNK_ANSI_ENCODING)
+
+class LnkTest(unittest.TestCase):
+    """The shortcuts are written in-process, on any OS. Their structure is read back
+    with parse_lnk, which follows MS-SHLLINK on its own: sizes, offsets and
+    terminators must agree with the bytes, and the IDList path items, the LinkInfo
+    LocalBasePath and the arguments with the target and arguments asked for.
+    test_data/lnk/runGame.lnk is a shortcut written by lnk_bytes and checked with
+    LnkParse3. It keeps the output byte for byte; it is not a WScript.Shell reference.
+    """
+
+    def reference(self):
+        with open(os.path.join(LNK_FOLDER, 'runGame.lnk'), 'rb') as f:
+            return f.read()
+
+    def assert_shortcut(self, data, target_path, arguments):
+        lnk = parse_lnk(data)
+        self.assertEqual(lnk['flags'], goglinks.LNK_HAS_TARGET_ID_LIST | goglinks.LNK_HAS_LINK_INFO | \
+            goglinks.LNK_HAS_ARGUMENTS | goglinks.LNK_IS_UNICODE)
+
+        drive, path = ntpath.splitdrive(target_path)
+        parts = [part for part in path.split('\\') if part]
+        items = lnk['items']
+        self.assertEqual(items[0], b'\x1f\x50' + MY_COMPUTER_CLSID)
+        self.assertEqual(items[1][0], 0x2F)
+        self.assertEqual(items[1][1:].rstrip(b'\x00').decode('ascii'), drive + '\\')
+        self.assertEqual([item_name(item) for item in items[2:]], parts)
+        self.assertEqual([item[0] for item in items[2:]], [0x31] * (len(parts) - 1) + [0x32])
+
+        info = lnk['link_info']
+        self.assertEqual(info['flags'], goglinks.LNK_VOLUME_ID_AND_LOCAL_BASE_PATH)
+        self.assertEqual(info['network_offset'], 0)
+        self.assertEqual(info['drive_type'], goglinks.LNK_DRIVE_FIXED)
+        self.assertEqual(info['base_path'], target_path)
+        self.assertEqual(info['suffix'], '')
+        self.assertEqual(info['base_path_unicode'], target_path)
+        self.assertEqual(info['suffix_unicode'], '')
+
+        self.assertEqual(lnk['arguments'], arguments)
+
+    def test_galaxy_shortcut_structure(self):
+        self.assert_shortcut(goglinks.lnk_bytes(goglinks.GALAXY_CLIENT_PATH, ARGUMENTS), goglinks.GALAXY_CLIENT_PATH,
+            ARGUMENTS)
+
+    def test_other_targets_structure(self):
+        for target_path in ('C:\\Program Files (x86)\\GOG Galaxy\\GalaxyClient.exe', 'D:\\Spiele\\Über\\Galaxy.exe',
+                'F:\\GalaxyClient.exe'):
+            with self.subTest(target_path=target_path):
+                self.assert_shortcut(goglinks.lnk_bytes(target_path, '/command=runGame /gameId=1'), target_path,
+                    '/command=runGame /gameId=1')
+
+    def test_reference_structure(self):
+        self.assert_shortcut(self.reference(), goglinks.GALAXY_CLIENT_PATH, ARGUMENTS)
+
+    def test_lnk_bytes_match_reference(self):
+        self.assertEqual(goglinks.lnk_bytes(goglinks.GALAXY_CLIENT_PATH, ARGUMENTS), self.reference())
+
+    def test_write_lnk_matches_reference(self):
+        with tempfile.TemporaryDirectory() as folder:
+            lnk_path = os.path.join(folder, 'game.lnk')
+            goglinks.write_lnk(lnk_path, goglinks.GALAXY_CLIENT_PATH, ARGUMENTS)
+            with open(lnk_path, 'rb') as f:
+                self.assertEqual(f.read(), self.reference())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+
+import goglinks
+
+NFO_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_data', 'nfo')
+
+def game_row(release_key, title, summary, meta, media, images, sort = None, installed = 0):
+    # A row as GAMES_QUERY returns it, with the GamePieces as JSON text.
+    return {
+        'userId': 1,
+        'releaseKey': release_key,
+        'gameId': release_key.split('_')[-1],
+        'platform': release_key.split('_')[0],
+        'title': json.dumps({ 'title': title }),
+        'sort': json.dumps({ 'title': sort if sort is not None else title.lower() }),
+        'summary': json.dumps({ 'summary': summary }),
+        'meta': json.dumps(meta),
+        'media': json.dumps(media),
+        'images': json.dumps(images),
+        'Installed': installed
+    }
+
+IMAGES = {
+    'background': 'https://images.gog-statics.com/1_bg.webp',
+    'squareIcon': 'https://images.gog-statics.com/1_icon.webp',
+    'verticalCover': 'https://images.gog-statics.com/1_cover.webp'
+}
+
+# The NFO of every row was written by the minidom based create_nfo, which write_nfo replaced.
+CASES = {
+    'full': game_row('gog_1', 'Full Game', 'First line.\nSecond line.',
+        { 'criticsScore': 87, 'developers': ['Developer A', 'Developer B'], 'publishers': ['Publisher'],
+          'genres': ['Shooter', 'Action'], 'themes': ['Historical'], 'releaseDate': 1084187110 },
+        { 'screenshots': ['https://images.gog-statics.com/1_snap_{formatter}.jpg', 'https://images.gog-statics.com/2_snap_{formatter}.jpg'],
+          'videos': [{ 'name': 'Trailer', 'provider': 'youtube', 'videoId': 'vid1' },
+                     { 'name': 'Gameplay', 'provider': 'youtube', 'videoId': 'vid2' }] },
+        IMAGES, installed = 1),
+    'escaping': game_row('steam_2', 'Amp & <less> "q" \'s', 'Ends with ]]> and & < > " \'',
+        { 'genres': ['R&D', '<Strategy>'], 'developers': ['"Quoted"'], 'releaseDate': 946684800 },
+        { 'screenshots': [], 'videos': [] },
+        { 'background': 'https://images.gog-statics.com/a&b.webp', 'squareIcon': None, 'verticalCover': None }),
+    'line_endings': game_row('gog_3', 'Line Endings', 'crlf\r\nbreak\rcr only\n\nblank line\n',
+        { 'genres': ['RPG'], 'releaseDate': 1262304000 }, { 'screenshots': [], 'videos': [] }, IMAGES),
+    'empty_fields': game_row('gog_4', 'Empty Fields', '', {}, {},
+        { 'background': None, 'squareIcon': None, 'verticalCover': None }, sort = 'z'),
+    'whitespace_unicode': game_row('epic_5', 'Ünïcødé ☃ 𝄞', '   ', { 'genres': ['tab\there', 'ünï'], 'themes': [] },
+        { 'screenshots': [], 'videos': [] }, IMAGES),
+}
+
+class NfoTest(unittest.TestCase):
+    """write_nfo must write the same bytes as the minidom pretty-printer it replaced.
+    """
+
+    def test_golden_files(self):
+        for name, row in sorted(CASES.items()):
+            with self.subTest(case=name):
+                with open(os.path.join(NFO_FOLDER, '{}.nfo'.format(name)), 'rb') as f:
+                    expected = f.read()
+                out = io.StringIO(newline='')
+                goglinks.write_nfo(goglinks.Game(row), out)
+                self.assertEqual(out.getvalue().encode('utf-8'), expected)
+
+    def test_create_nfo_writes_the_golden_file(self):
+        game = goglinks.Game(CASES['full'])
+        with tempfile.TemporaryDirectory() as folder:
+            goglinks.create_nfo(game, folder, True)
+            with open(os.path.join(folder, '{}.nfo'.format(game.fileTitle)), 'r', encoding='utf-8', newline='') as f:
+                written = f.read()
+        with open(os.path.join(NFO_FOLDER, 'full.nfo'), 'r', encoding='utf-8', newline='') as f:
+            self.assertEqual(written.replace(os.linesep, '\n'), f.read())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +0,0 @@
-param ( 
-    [string]$SourceExe, 
-    [string]$ArgumentsToSourceExe, 
-    [string]$DestinationPath )
-    
-$WshShell = New-Object -comObject WScript.Shell
-$Shortcut = $WshShell.CreateShortcut($DestinationPath)
-$Shortcut.TargetPath = $SourceExe
-$Shortcut.Arguments = $ArgumentsToSourceExe
-$Shortcut.Save()
\ No newline at end of file
@@ -0,0 +1,56 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import benchmark
+import goglinks
+
+class SnapshotTest(unittest.TestCase):
+    """With snapshot the GOG db is only locked while it is copied, a writer like
+    GalaxyClient can commit while the games are read.
+    """
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.folder.name, 'galaxy-2.0.db')
+        benchmark.create_synthetic_db(self.db_path, 500)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def commit(self):
+        # A write that gives up at once when the db is locked.
+        conn = sqlite3.connect(self.db_path, timeout=0)
+        try:
+            conn.execute('UPDATE ReleaseProperties SET isDlc = isDlc WHERE rowid = 1')
+            conn.commit()
+        finally:
+            conn.close()
+
+    def test_writer_commits_while_snapshot_is_read(self):
+        games = goglinks.iter_games(self.folder.name, snapshot=True)
+        try:
+            next(games)
+            self.commit()
+            self.assertGreater(sum(1 for _ in games), 0)
+        finally:
+            games.close()
+
+    def test_live_read_locks_writer(self):
+        # Without snapshot the same write fails, the test above is not vacuous.
+        games = goglinks.iter_games(self.folder.name, snapshot=False)
+        try:
+            next(games)
+            with self.assertRaisesRegex(sqlite3.OperationalError, 'database is locked'):
+                self.commit()
+        finally:
+            games.close()
+
+    def test_concurrent_writer_never_locked(self):
+        result = benchmark.time_concurrent_writer(self.folder.name, True)
+        self.assertGreater(result['commits'], 0)
+        self.assertEqual(result['locked'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
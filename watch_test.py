@@ -0,0 +1,73 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import benchmark
+import goglinks
+
+class WatchPassTest(unittest.TestCase):
+    """A watch pass runs the changed games, and the games whose files a previous
+    pass failed to make or that were deleted since, without a change in the db.
+    """
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        benchmark.create_synthetic_db(os.path.join(self.folder.name, 'galaxy-2.0.db'), 20)
+        self.output_folder = os.path.join(self.folder.name, 'out')
+        self.target = goglinks.RunTarget(self.output_folder, 'AEL', create_nfo=True, download_images=True)
+        self.fingerprints = {}
+        self.requested = []
+        self.failing = set()
+
+    def tearDown(self):
+        goglinks.file_index.reset()
+        self.folder.cleanup()
+
+    def download(self, img_url, file_path, connections = None, validators = None):
+        self.requested.append(img_url)
+        if img_url in self.failing:
+            self.failing.discard(img_url)
+            raise ConnectionError('Connection reset')
+        with open(file_path, 'wb') as f:
+            f.write(img_url.encode('utf-8'))
+        goglinks.file_index.add(file_path)
+
+    def watch_pass(self):
+        with mock.patch.object(goglinks, 'net_download_img', self.download):
+            return goglinks.watch_pass(self.folder.name, [self.target], 4, goglinks.GALAXY_CLIENT_PATH, None,
+                self.fingerprints)
+
+    def cover(self):
+        game = goglinks.load_games(self.folder.name)[0]
+        return game.cover, os.path.join(self.output_folder, 'boxfronts', '{}.png'.format(game.fileTitle))
+
+    def test_failed_download_fetched_by_next_pass(self):
+        url, path = self.cover()
+        self.failing.add(url)
+        self.assertTrue(self.watch_pass())
+        self.assertFalse(os.path.exists(path))
+
+        self.requested = []
+        self.assertFalse(self.watch_pass())
+        self.assertTrue(os.path.exists(path))
+        self.assertIn(url, self.requested)
+
+    def test_deleted_file_made_again(self):
+        url, path = self.cover()
+        self.assertFalse(self.watch_pass())
+        os.remove(path)
+
+        self.requested = []
+        self.assertFalse(self.watch_pass())
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(self.requested, [url])
+
+    def test_complete_library_not_run_again(self):
+        self.assertFalse(self.watch_pass())
+        self.requested = []
+        self.assertFalse(self.watch_pass())
+        self.assertEqual(self.requested, [])
+
+if __name__ == '__main__':
+    unittest.main()